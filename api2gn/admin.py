@@ -17,6 +17,7 @@ class Api2GNAdmin(CruvedProtectedMixin, ModelView):
         "nb_row_total",
         "nb_row_last_import",
         "schedule_frequency",
+        "checkpoint_date",
     )
     column_labels = dict(
         name="Nom du parser",
@@ -25,6 +26,7 @@ class Api2GNAdmin(CruvedProtectedMixin, ModelView):
         nb_row_total="Nombre total importé",
         nb_row_last_import="Nombre au dernier import",
         schedule_frequency="Fréquence de MAJ (en jour)",
+        checkpoint_date="Import interrompu (reprise possible)",
     )
     form_columns = (
         "name",
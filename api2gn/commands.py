@@ -16,6 +16,11 @@ def cmd_list_parsers():
 @click.command()
 @click.argument("name")
 @click.option("--dry-run", is_flag=True)
-def run(name, dry_run):
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Reprendre l'import depuis le dernier lot commité",
+)
+def run(name, dry_run, resume):
     Parser = get_parser(name)
-    Parser().run(dry_run)
+    Parser().run(dry_run, resume=resume)
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
 
 
 class Api2GNSchema(Schema):
@@ -22,7 +22,62 @@ class Api2GNSchema(Schema):
     PARSER_RETRY_HTTP_STATUS = fields.List(
         fields.Integer(),
         required=False,
-        missing=lambda: [503],
+        missing=lambda: [429, 500, 502, 503, 504],
+    )
+    # Backoff exponentiel : PARSER_RETRY_SLEEP_TIME * 2^n, plafonné (en s)
+    PARSER_RETRY_MAX_SLEEP_TIME = fields.Integer(
+        required=False, missing=120
+    )
+    # Requêtes par seconde max par hôte, "*" pour tous les autres hôtes
+    # ex : { "api.gbif.org" = 10, "my-api.plantnet.org" = 2 }
+    PARSER_RATE_LIMITS = fields.Dict(
+        keys=fields.String(),
+        values=fields.Float(),
+        required=False,
+        missing=dict,
+    )
+    # Un hôte est ignoré PARSER_CIRCUIT_BREAKER_COOLDOWN secondes après
+    # PARSER_CIRCUIT_BREAKER_THRESHOLD échecs consécutifs (0 : désactivé)
+    PARSER_CIRCUIT_BREAKER_THRESHOLD = fields.Integer(
+        required=False, missing=5
+    )
+    PARSER_CIRCUIT_BREAKER_COOLDOWN = fields.Integer(
+        required=False, missing=60
+    )
+    # Chargement par lots dans la synthèse (JSONParser / WFSParser)
+    PARSER_BATCH_SIZE = fields.Integer(
+        required=False, missing=1000
+    )
+    PARSER_COMMIT_EVERY = fields.Integer(
+        required=False, missing=10000
+    )
+    PARSER_LOAD_METHOD = fields.String(
+        required=False,
+        missing="copy",
+        validate=validate.OneOf(["copy", "insert"]),
+    )
+    # "merge" : upsert sur (id_source, entity_source_pk_value) ou unique_id_sinp
+    PARSER_LOAD_MODE = fields.String(
+        required=False,
+        missing="insert",
+        validate=validate.OneOf(["insert", "merge"]),
+    )
+    # Connexions HTTP gardées ouvertes par hôte
+    PARSER_HTTP_POOL_SIZE = fields.Integer(
+        required=False, missing=10
+    )
+    # Nombre de pages téléchargées en parallèle quand le total est connu
+    PARSER_PREFETCH_PAGES = fields.Integer(
+        required=False, missing=4
+    )
+    # Reprojection des géométries côté python (pyproj + shapely >= 2)
+    PARSER_CLIENT_REPROJECTION = fields.Boolean(
+        required=False, missing=False
+    )
+    # Durée (en jours) pendant laquelle un nom scientifique sans cd_nom
+    # n'est plus recherché (cache api2gn.cd_nom_cache), 0 : toujours réessayer
+    PARSER_CD_NOM_CACHE_NEGATIVE_TTL = fields.Integer(
+        required=False, missing=7
     )
 
     # --------------------------------------------------
@@ -74,3 +129,14 @@ class Api2GNSchema(Schema):
     plantnet_mapping_json = fields.String(
         required=False, allow_none=True
     )
+
+    # Appels TAXREF-LD simultanés pour les noms absents du TAXREF local
+    plantnet_taxref_ld_workers = fields.Integer(
+        required=False, missing=8
+    )
+
+    # Durée max (s) consacrée à TAXREF-LD par import, 0 : illimitée.
+    # Au-delà, les occurrences des noms sans réponse sont rejetées (mode strict)
+    plantnet_taxref_ld_budget = fields.Integer(
+        required=False, missing=600
+    )
@@ -0,0 +1,149 @@
+"""
+Date ranges of partial dates and ISO 8601 intervals.
+
+A value is read in a single pass into a (date_min, date_max) couple of
+strings, as expected by the synthese:
+
+    2020                  -> 2020-01-01, 2020-12-31
+    2020-02               -> 2020-02-01, 2020-02-29
+    2020-05-01            -> 2020-05-01, 2020-05-01
+    2020-05-01T10:30:00Z  -> 2020-05-01 10:30:00 (both)
+    2020-05-01/2020-05-03 -> 2020-05-01, 2020-05-03
+    2020-05-01/03         -> 2020-05-01, 2020-05-03 (abbreviated end)
+    2020-05-01T10:00/2020-05-01 -> 2020-05-01 10:00:00, 2020-05-01 23:59:59
+
+Anything else goes through dateutil. Results are memoized: source dates
+(GBIF eventDate...) repeat a lot.
+"""
+from calendar import monthrange
+from functools import lru_cache
+
+from dateutil.parser import parse
+
+DATE_RANGE_CACHE_SIZE = 65536
+
+
+def _number(text, start, end, minimum, maximum):
+    value = text[start:end]
+    if len(value) != end - start or not value.isdigit():
+        raise ValueError
+    value = int(value)
+    if not minimum <= value <= maximum:
+        raise ValueError
+    return value
+
+
+def _time(text):
+    """
+    HH[:MM[:SS[.fff]]] with an optional Z or +/-HH[:MM] offset, the
+    offset is dropped: the local time of the observation is kept
+    """
+    for i, char in enumerate(text):
+        if char in "Z+-":
+            text = text[:i]
+            break
+    text = text.partition(".")[0].partition(",")[0]
+    hour = _number(text, 0, 2, 0, 24)
+    minute = second = 0
+    if len(text) > 2:
+        if text[2] != ":":
+            raise ValueError
+        minute = _number(text, 3, 5, 0, 59)
+        if len(text) > 5:
+            if text[5] != ":":
+                raise ValueError
+            second = _number(text, 6, 8, 0, 60)
+            if len(text) > 8:
+                raise ValueError
+    if hour == 24 and (minute or second):
+        raise ValueError
+    return f"{hour:02d}:{minute:02d}:{second:02d}"
+
+
+def _tokenize(text):
+    """
+    (date_min, date_max) of a single ISO 8601 date, partial date or
+    datetime, ValueError if the value is not one of those forms
+    """
+    length = len(text)
+    year = _number(text, 0, 4, 1, 9999)
+    if length == 4:
+        return f"{year:04d}-01-01", f"{year:04d}-12-31"
+    if text[4] != "-":
+        raise ValueError
+    month = _number(text, 5, 7, 1, 12)
+    last_day = monthrange(year, month)[1]
+    if length == 7:
+        return f"{year:04d}-{month:02d}-01", f"{year:04d}-{month:02d}-{last_day:02d}"
+    if text[7] != "-":
+        raise ValueError
+    day = _number(text, 8, 10, 1, last_day)
+    date = f"{year:04d}-{month:02d}-{day:02d}"
+    if length == 10:
+        return date, date
+    if text[10] not in "T ":
+        raise ValueError
+    datetime = f"{date} {_time(text[11:])}"
+    return datetime, datetime
+
+
+def _parse_single(text):
+    try:
+        return _tokenize(text)
+    except (ValueError, IndexError):
+        pass
+    try:
+        date = parse(text).strftime("%Y-%m-%d %H:%M:%S")
+    except (ValueError, OverflowError) as e:
+        raise ValueError(
+            f"Invalid date format for {text}. Please use YYYY, YYYY-MM, "
+            "YYYY-MM-DD, an ISO 8601 interval or a valid date format."
+        ) from e
+    return date, date
+
+
+@lru_cache(maxsize=DATE_RANGE_CACHE_SIZE)
+def parse_date_range(value):
+    """
+    (date_min, date_max) of a partial date, a date, a datetime or an
+    ISO 8601 interval start/end. Raise ValueError if it cannot be read
+    """
+    value = value.strip()
+    start, separator, end = value.partition("/")
+    # 01/05/2020, 2020/05/01... are single dates for dateutil
+    if not separator or "/" in end or not start[:4].isdigit():
+        return _parse_single(value)
+    start, end = start.strip(), end.strip()
+    # abbreviated end (2020-05-01/03, 2020-05-01T10:00/12:00): the missing
+    # leading part is the one of the start
+    if end[2:3] == ":" and len(start) > 10 and start[10] in "T ":
+        end = start[:11] + end
+    elif 0 < len(end) < len(start) and not (len(end) >= 4 and end[:4].isdigit()):
+        end = start[: len(start) - len(end)] + end
+    date_min = _parse_single(start)[0]
+    date_max = _parse_single(end)[1]
+    # a date-only end after a start with a time is the end of that day
+    if len(date_max) == 10 and len(date_min) > 10:
+        date_max += " 23:59:59"
+    # compared at the same precision: a date-only start is the start of the day
+    if (date_max + " 23:59:59")[:19] < (date_min + " 00:00:00")[:19]:
+        raise ValueError(f"Invalid date interval {value}: end is before start")
+    return date_min, date_max
+
+
+def parse_date_ranges(values):
+    """
+    Date ranges of a batch of values (a page): each distinct value is read
+    once. Return a dict value -> (date_min, date_max), None for the values
+    that cannot be read, and the dict of errors value -> ValueError
+    """
+    ranges, errors = {}, {}
+    for value in values:
+        if value is None or value in ranges:
+            continue
+        try:
+            ranges[value] = parse_date_range(value)
+        except ValueError as e:
+            ranges[value] = None
+            errors[value] = e
+    return ranges, errors
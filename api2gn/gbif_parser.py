@@ -1,12 +1,24 @@
-from pygbif import occurrences, registry
+import csv
+import io
+import json
+import os
+import tempfile
+import zipfile
+from itertools import chain, islice
+
+from datetime import date
+
 from shapely import wkt
+from shapely.geometry import MultiPolygon, box
+from shapely.geometry.polygon import orient
 from sqlalchemy import select
 from sqlalchemy.sql import func
 from geoalchemy2.shape import from_shape
 from api2gn.parsers import JSONParser
-from api2gn.utils import generate_date_range
-import requests
+from api2gn.dates import parse_date_ranges
+from api2gn.utils import iter_concurrent
 import click
+from uuid import UUID
 
 from geonature.utils.env import db
 
@@ -14,18 +26,92 @@ from apptax.taxonomie.models import TaxrefLiens
 
 from geonature.core.gn_meta.models import TDatasets, TAcquisitionFramework
 
+GBIF_API_URL = "https://api.gbif.org/v1"
+# the occurrence search API cannot page beyond this number of records
+GBIF_SEARCH_MAX_RECORDS = 100000
+# smallest wkt tile of a partitioned search (degrees)
+PARTITION_MIN_TILE_SIZE = 0.01
+
+
+def _split_range(value):
+    """
+    Split a GBIF "min,max" integer range parameter in two halves,
+    None if it is a single value (or unbounded)
+    """
+    bounds = str(value).split(",")
+    if len(bounds) != 2 or "*" in bounds:
+        return None
+    low, high = int(bounds[0]), int(bounds[1])
+    if low >= high:
+        return None
+    middle = (low + high) // 2
+    return [
+        str(low) if low == middle else f"{low},{middle}",
+        str(high) if middle + 1 == high else f"{middle + 1},{high}",
+    ]
+
+
+def _partition_key(filters):
+    """
+    Stable text key of a partition (its search parameters), kept in the
+    checkpoint of a partitioned search
+    """
+    return json.dumps(filters, sort_keys=True, default=str)
+
+
+def _polygons(geometry):
+    if geometry.is_empty:
+        return []
+    if geometry.geom_type == "Polygon":
+        return [geometry]
+    if hasattr(geometry, "geoms"):
+        return [polygon for part in geometry.geoms for polygon in _polygons(part)]
+    # points or lines on the tile border
+    return []
+
+
+def _gbif_wkt(polygons):
+    # GBIF expects counter-clockwise polygons
+    polygons = [orient(polygon, sign=1.0) for polygon in polygons]
+    geometry = polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+    return wkt.dumps(geometry, rounding_precision=6, trim=True)
+
+
 # https://dwc.tdwg.org/list/#dwc_occurrenceStatus
 # http://rs.tdwg.org/dwc/terms/lifeStage
 # http://rs.tdwg.org/dwc/terms/sex
 class GBIFParser(JSONParser):
+    """
+    Import GBIF occurrences, from the occurrence search API (`api_filters`,
+    at most 100 000 records) or from an occurrence download (Darwin Core
+    Archive or simple CSV zip), read row by row straight out of the zip.
+
+    Attributes:
+        dwca_path(str): path of a downloaded GBIF occurrence zip
+        download_key(str): key of a GBIF occurrence download (produced with
+            the GBIF download API or on gbif.org), fetched at the start of
+            the import
+        partitioned(bool): split the search (by year, month then `wkt`
+            tiles) into sub-searches of at most `partition_max_records`
+            records, fetched concurrently
+        partition_min_year(int): records older than this year form a single
+            partition (split by month and tiles only)
+    """
+
     srid = 4326
     progress_bar = False  # useless multiple single request
-    row_data = {}
+    # lastInterpreted windows overlap: prefer load_mode = "merge" (upsert on
+    # (id_source, gbifID)) once the unique index of the synthese exists
     create_dataset = False  # Indicate if dataset should be created
     af_id = None  # The id of the acquisition framework. If not set, it will be created with name GBIF
-    datasets_id = (
-        {}
-    )  # A dict to store dataset id. Key is the uuid and value is the dataset id. Avoid multiple request
+    # A dict to store dataset id. Key is the uuid and value is the dataset id.
+    # Shared by the parsers of the process, warmed from TDatasets at start
+    datasets_id = {}
+    dwca_path = None
+    download_key = None
+    partitioned = False
+    partition_max_records = GBIF_SEARCH_MAX_RECORDS
+    partition_min_year = 1900
 
     # Default GBIF api filters for occurrence
     api_filters = {
@@ -86,9 +172,18 @@ class GBIFParser(JSONParser):
                 ]
             )
         self.data = None
+        # taxonKey -> cd_nom (None without TAXREF link) and
+        # taxonKey -> (skipped occurrences, scientificName) for the report
+        self.taxref_cd_noms = {}
+        self.unknown_taxon_keys = {}
+        # datasets created in the current transaction (uuid -> id_dataset),
+        # shared in datasets_id once committed
+        self.new_datasets_id = {}
 
         self.validate_maping()
-        if not "id_dataset" in self.constant_fields and not self.create_dataset:
+        # occurrences are fetched lazily by next_page
+        self.can_import = "id_dataset" in self.constant_fields or self.create_dataset
+        if not self.can_import:
             click.secho(
                 f"You need to set create_dataset=True or set id_dataset in constant_fields. No data will be imported",
                 fg="red",
@@ -98,21 +193,186 @@ class GBIFParser(JSONParser):
             # if not default value is set
             if self.create_dataset and not self.af_id:
                 self.af_id = self._get_or_create_af()
+            if self.create_dataset:
+                self.load_datasets()
+
+    @property
+    def is_download(self):
+        return bool(self.dwca_path or self.download_key)
+
+    def fetch_download(self):
+        """
+        Download the zip of the GBIF occurrence download `download_key`
+        in a temporary file, return its path. The caller removes the file
+        """
+        status = self.request_or_retry(
+            f"{GBIF_API_URL}/occurrence/download/{self.download_key}"
+        ).json()
+        if status.get("status") != "SUCCEEDED":
+            raise click.ClickException(
+                f"GBIF download {self.download_key} is not ready : {status.get('status')}"
+            )
+        click.secho(
+            f"Downloading GBIF occurrence download {self.download_key} "
+            f"({status.get('totalRecords')} records)",
+            fg="green",
+        )
+        response = self.request_or_retry(
+            f"{GBIF_API_URL}/occurrence/download/request/{self.download_key}",
+            stream=True,
+        )
+        archive = tempfile.NamedTemporaryFile(
+            prefix="gbif_", suffix=".zip", delete=False
+        )
+        try:
+            with archive:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    archive.write(chunk)
+        except BaseException:
+            os.remove(archive.name)
+            raise
+        finally:
+            response.close()
+        return archive.name
+
+    def iter_download_occurrences(self):
+        """
+        Yield (key, occurrence) from the core file of a GBIF occurrence zip
+        (occurrence.txt of a DwC-A, or the tab separated file of a simple CSV
+        download) without extracting it. Occurrences have the search API
+        keys used by the mapping
+        """
+        path = self.dwca_path or self.fetch_download()
+        try:
+            with zipfile.ZipFile(path) as archive:
+                names = archive.namelist()
+                core = "occurrence.txt" if "occurrence.txt" in names else None
+                if core is None:
+                    core = next(
+                        (name for name in names if name.endswith(".csv")), None
+                    )
+                if core is None:
+                    raise click.ClickException(f"No occurrence file found in {path}")
+                with archive.open(core) as raw:
+                    reader = csv.DictReader(
+                        io.TextIOWrapper(raw, encoding="utf-8", newline=""),
+                        delimiter="\t",
+                        quoting=csv.QUOTE_NONE,
+                    )
+                    for row in reader:
+                        occurrence = self._download_row(row)
+                        if occurrence is not None:
+                            yield occurrence["key"], occurrence
+        finally:
+            # the downloaded archive is removed even if the import fails
+            if not self.dwca_path and os.path.exists(path):
+                os.remove(path)
+
+    def _download_row(self, row):
+        """
+        Occurrence of a row of the archive, None (row skipped) without a
+        valid gbifID. Malformed numeric values are left empty
+        """
+        occurrence = {key: value for key, value in row.items() if value}
+        try:
+            occurrence["key"] = int(occurrence["gbifID"])
+        except (KeyError, ValueError):
+            click.secho(
+                f"[DwC-A] Row skipped, invalid gbifID: {row.get('gbifID')!r}",
+                fg="red",
+            )
+            return None
+        for key, cast in (
+            ("decimalLatitude", float),
+            ("decimalLongitude", float),
+            ("individualCount", int),
+        ):
+            if key not in occurrence:
+                continue
+            try:
+                occurrence[key] = cast(occurrence[key])
+            except ValueError:
+                click.secho(
+                    f"[data #{occurrence['key']}] Invalid {key}: {occurrence[key]!r}",
+                    fg="yellow",
+                )
+                del occurrence[key]
+        if "occurrenceID" in occurrence:
+            occurrence["identifiers"] = [{"identifier": occurrence["occurrenceID"]}]
+        return occurrence
 
-            self.fetch_occurrence_ids_search()
+    def iter_occurrences(self, offset=0):
+        """
+        Yield (key, occurrence) from the download or the search API,
+        starting at the `offset`-th occurrence
+        """
+        if not self.can_import:
+            return iter(())
+        if self.is_download:
+            return islice(self.iter_download_occurrences(), offset, None)
+        return self.iter_search_occurrences(offset)
 
-    def _test_dataset_uuid(self, uuid):
-        if uuid in self.datasets_id:
-            return self.datasets_id[uuid]
+    def end(self):
+        super().end()
+        self.print_taxref_report()
 
-        dataset = db.session.execute(
-            select(TDatasets).where(TDatasets.unique_dataset_id == uuid).limit(1)
-        ).scalar()
-        if not dataset:
-            gbif_dataset = self._fetch_dataset_data()
-            dataset = self._create_dataset(gbif_dataset)
-        self.datasets_id[uuid] = dataset.id_dataset
-        return self.datasets_id[uuid]
+    def load_datasets(self):
+        """
+        Warm the uuid -> id_dataset map with the datasets already created
+        under the acquisition framework (previous runs, other workers)
+        """
+        datasets = db.session.execute(
+            select(TDatasets.unique_dataset_id, TDatasets.id_dataset).where(
+                TDatasets.id_acquisition_framework == self.af_id
+            )
+        ).all()
+        for uuid, id_dataset in datasets:
+            self.datasets_id[str(uuid)] = id_dataset
+
+    def resolve_datasets(self, dataset_keys):
+        """
+        Map the GBIF datasetKeys of a page to their id_dataset: datasets
+        already in TDatasets are found with a single query, the missing ones
+        are fetched concurrently from the GBIF registry and created in the
+        transaction of the current batch (committed with it by commit())
+        """
+        missing = (
+            {str(key) for key in dataset_keys if key}
+            - self.datasets_id.keys()
+            - self.new_datasets_id.keys()
+        )
+        if not missing:
+            return
+        datasets = db.session.execute(
+            select(TDatasets.unique_dataset_id, TDatasets.id_dataset).where(
+                TDatasets.unique_dataset_id.in_(missing)
+            )
+        ).all()
+        for uuid, id_dataset in datasets:
+            self.datasets_id[str(uuid)] = id_dataset
+        missing -= self.datasets_id.keys()
+        if not missing:
+            return
+        gbif_datasets = iter_concurrent(
+            self.fetch_dataset, sorted(missing), max(self.prefetch_pages, 1)
+        )
+        created = [
+            self._create_dataset(gbif_dataset)
+            for gbif_dataset in gbif_datasets
+            if gbif_dataset
+        ]
+        if not created:
+            return
+        db.session.flush()
+        for dataset in created:
+            self.new_datasets_id[str(dataset.unique_dataset_id)] = dataset.id_dataset
+
+    def commit(self, dry_run=False):
+        committed = super().commit(dry_run)
+        if committed:
+            self.datasets_id.update(self.new_datasets_id)
+            self.new_datasets_id.clear()
+        return committed
 
     def _create_dataset(self, gbif_dataset):
         """
@@ -143,15 +403,17 @@ class GBIFParser(JSONParser):
             f"Create dataset {dataset.dataset_name} ...",
             fg="green",
         )
-        db.session.commit()
         return dataset
 
-    def _fetch_dataset_data(self):
-        dataset_key = self.data.get("datasetKey")
-        if dataset_key:
-            registry.datasets(limit=1)
-            return registry.datasets(uuid=dataset_key)
-        return None
+    def fetch_dataset(self, dataset_key):
+        """
+        Return the GBIF registry metadata of a dataset (None on error)
+        """
+        try:
+            return self.request_or_retry(f"{GBIF_API_URL}/dataset/{dataset_key}").json()
+        except click.ClickException as e:
+            click.secho(f"Could not fetch GBIF dataset {dataset_key} : {e}", fg="red")
+            return None
 
     def _get_or_create_af(self):
         """
@@ -183,56 +445,274 @@ class GBIFParser(JSONParser):
             return self.cd_nomenclature_mapping[field].get(value.lower())
         return None
 
-    def fetch_occurrence_ids_search(self):
-        click.secho(f"Fetching data from GBIF", fg="green")
-        self.gbif_search_occurence(self.limit, offset=0)
-        return self.row_data
+    def _api_params(self, filters):
+        # the GBIF API expects lowercase booleans, lists are sent as repeated params
+        return {
+            key: str(value).lower() if isinstance(value, bool) else value
+            for key, value in filters.items()
+        }
 
-    def gbif_search_occurence(self, limit=1000, offset=0):
-        self.api_filters["limit"] = self.limit
-        self.api_filters["offset"] = offset
-        response = occurrences.search(**dict(self.api_filters))
+    def search_page(self, offset, filters=None, limit=None):
+        """
+        Return a page of the occurrence search API (`api_filters` by default)
+        """
+        filters = self.api_filters if filters is None else filters
+        limit = self.limit if limit is None else limit
+        return self.request_or_retry(
+            f"{GBIF_API_URL}/occurrence/search",
+            params=self._api_params({**filters, "limit": limit, "offset": offset}),
+        ).json()
 
-        total_number = response["count"]
-        if total_number == 0:
-            return
-        if total_number > 100000:
+    def count_records(self, filters):
+        return self.search_page(0, filters, limit=0)["count"]
+
+    def split_partition(self, filters, by_date=True):
+        """
+        Split a search in disjoint sub-searches: by year range, then by
+        month (unless `by_date` is False), then by quarter of the `wkt`
+        polygon. Return [] when the search cannot be split any more.
+        Records without a year or a month are in none of the date
+        sub-searches, records without coordinates in none of the tiles
+        """
+        if by_date:
+            year = filters.get("year")
+            if year is None:
+                return [
+                    {**filters, "year": f"*,{self.partition_min_year - 1}"},
+                    {
+                        **filters,
+                        "year": f"{self.partition_min_year},{date.today().year}",
+                    },
+                ]
+            halves = _split_range(year)
+            if halves:
+                return [{**filters, "year": half} for half in halves]
+            halves = _split_range(filters.get("month", "1,12"))
+            if halves:
+                return [{**filters, "month": half} for half in halves]
+
+        geometry = wkt.loads(filters["wkt"]) if filters.get("wkt") else box(-180, -90, 180, 90)
+        xmin, ymin, xmax, ymax = geometry.bounds
+        if xmax - xmin < PARTITION_MIN_TILE_SIZE and ymax - ymin < PARTITION_MIN_TILE_SIZE:
+            return []
+        xmid, ymid = (xmin + xmax) / 2, (ymin + ymax) / 2
+        partitions = []
+        for tile in (
+            box(xmin, ymin, xmid, ymid),
+            box(xmid, ymin, xmax, ymid),
+            box(xmin, ymid, xmid, ymax),
+            box(xmid, ymid, xmax, ymax),
+        ):
+            polygons = _polygons(geometry.intersection(tile))
+            if polygons:
+                partitions.append({**filters, "wkt": _gbif_wkt(polygons)})
+        return partitions
+
+    def plan_partitions(self, filters, count=None):
+        """
+        Return the (filters, number of records) of sub-searches covering
+        `filters`, each one small enough to be paged by the search API.
+        The counts of sibling partitions are requested concurrently
+        """
+        if count is None:
+            count = self.count_records(filters)
+        if count <= self.partition_max_records:
+            return [(filters, count)] if count else []
+        sub_filters = self.split_partition(filters)
+        sub_counts = self.count_partitions(sub_filters)
+        missing = count - sum(sub_counts)
+        if (
+            missing > 0
+            and sub_filters
+            and sub_filters[0].get("wkt") == filters.get("wkt")
+        ):
             click.secho(
-                "To much data use download function first or change download params",
+                f"{missing} of the {count} records of {filters} have no year "
+                "or month, the search is split by tile",
+                fg="yellow",
+            )
+            sub_filters = self.split_partition(filters, by_date=False)
+            sub_counts = self.count_partitions(sub_filters)
+            missing = count - sum(sub_counts)
+        if not sub_filters:
+            click.secho(
+                f"{count} records for {filters}, only the first "
+                f"{self.partition_max_records} are fetched",
                 fg="red",
             )
-            return
-        click.secho(f"Get data {offset + limit}/{total_number}", fg="green")
+            return [(filters, self.partition_max_records)]
+        if missing > 0:
+            click.secho(
+                f"{missing} of the {count} records of {filters} are in none of "
+                "its partitions (no date or no coordinates) and are not fetched",
+                fg="red",
+            )
+        partitions = []
+        for sub, sub_count in zip(sub_filters, sub_counts):
+            partitions += self.plan_partitions(sub, sub_count)
+        return partitions
 
-        search_occurence = {
-            result["key"]: result
-            for result in response.get("results", {})
-            if "key" in result
-        }
-        if search_occurence:
-            self.row_data = self.row_data | search_occurence
-        if response["endOfRecords"] == False:
-            self.gbif_search_occurence(limit=limit, offset=limit + offset)
+    def count_partitions(self, partitions):
+        """
+        Number of records of each search of `partitions`, requested
+        concurrently
+        """
+        return list(
+            iter_concurrent(
+                self.count_records, partitions, max(self.prefetch_pages, 1)
+            )
+        )
 
-    def fetch_taxref_cd_nom(self):
+    def iter_partitioned_pages(self, cursor=None):
+        """
+        Yield (cursor, page of (key, occurrence)) of a partitioned search,
+        after the page of `cursor` when resuming: all the pages of all the
+        partitions are fetched by a bounded pool of `prefetch_pages`
+        workers, occurrences are deduplicated on their GBIF key (a point on
+        a tile border is found twice).
+        The cursor of a page is its partition (search parameters) and
+        offset, so it is found again in a new planning of the search
+        """
+        click.secho("Planning GBIF partitions", fg="green")
+        partitions = self.plan_partitions(dict(self.api_filters))
+        self._total = sum(count for _filters, count in partitions)
+        click.secho(
+            f"{self._total} records in {len(partitions)} partition(s)", fg="green"
+        )
+        tasks = [
+            (filters, offset)
+            for filters, count in partitions
+            for offset in range(0, count, self.limit)
+        ]
+        tasks = tasks[self._resume_task(tasks, cursor) :]
+        responses = iter_concurrent(
+            lambda task: self.search_page(task[1], task[0]),
+            tasks,
+            max(self.prefetch_pages, 1),
+        )
+        seen = set()
         try:
-            cd_nom = db.session.scalar(
-                select(TaxrefLiens.cd_nom)
-                .where(TaxrefLiens.ct_name == "GBIF")
-                .where(TaxrefLiens.ct_sp_id == str(self.data["taxonKey"]))
-                .limit(1)
+            for (filters, offset), response in zip(tasks, responses):
+                page = []
+                for result in response.get("results") or []:
+                    if result["key"] not in seen:
+                        seen.add(result["key"])
+                        page.append((result["key"], result))
+                yield {"partition": _partition_key(filters), "offset": offset}, page
+        finally:
+            responses.close()
+
+    def _resume_task(self, tasks, cursor):
+        """
+        Index of the first (filters, offset) task after the page of `cursor`
+        """
+        if not cursor or "partition" not in cursor:
+            return 0
+        done = [
+            i
+            for i, (filters, offset) in enumerate(tasks)
+            if _partition_key(filters) == cursor["partition"]
+            and offset <= cursor["offset"]
+        ]
+        if not done:
+            click.secho(
+                "The partition of the checkpoint is no longer planned "
+                "(the records changed), the search starts over",
+                fg="yellow",
             )
-            if not cd_nom:
-                click.secho(
-                    f'[data #{self.occurrence_id}] No matching cd_nom found for taxon: {self.data["taxonKey"]}',
-                    fg="yellow",
-                )
-            return cd_nom
-        except Exception as e:
+            return 0
+        return done[-1] + 1
+
+    def iter_search_occurrences(self, offset=0):
+        """
+        Yield (key, occurrence) from the occurrence search API, page after
+        page. Once the number of records is known, `prefetch_pages` pages
+        are fetched in the background while the previous ones are
+        transformed and loaded
+        """
+        click.secho(f"Fetching data from GBIF", fg="green")
+        response = self.search_page(offset)
+        total_number = self._total = response["count"]
+        if total_number > GBIF_SEARCH_MAX_RECORDS:
             click.secho(
-                f"[data #{self.occurrence_id}] Fetching taxref cd_nom in Error: {e}",
+                "To much data use partitioned = True, a GBIF download "
+                "(download_key or dwca_path) or change download params",
                 fg="red",
             )
+            return
+        next_pages = iter_concurrent(
+            self.search_page,
+            range(offset + self.limit, total_number, self.limit),
+            max(self.prefetch_pages, 1),
+        )
+        try:
+            for response in chain([response], next_pages):
+                results = response.get("results") or []
+                offset += len(results)
+                click.secho(f"Get data {offset}/{total_number}", fg="green")
+                for result in results:
+                    yield result["key"], result
+                if response["endOfRecords"] or not results:
+                    break
+        finally:
+            next_pages.close()
+
+    def load_taxref_cd_noms(self, taxon_keys):
+        """
+        Resolve the GBIF taxonKeys not resolved yet with a single TaxrefLiens
+        query and keep them (None when no link exists) for the whole run
+        """
+        taxon_keys = {str(key) for key in taxon_keys if key is not None}
+        taxon_keys -= self.taxref_cd_noms.keys()
+        if not taxon_keys:
+            return
+        try:
+            links = db.session.execute(
+                select(TaxrefLiens.ct_sp_id, TaxrefLiens.cd_nom)
+                .where(TaxrefLiens.ct_name == "GBIF")
+                .where(TaxrefLiens.ct_sp_id.in_(taxon_keys))
+            ).all()
+        except Exception as e:
+            click.secho(f"Fetching taxref cd_nom in Error: {e}", fg="red")
+            return
+        for ct_sp_id, cd_nom in links:
+            # several links for a taxonKey: keep one, as the former limit(1)
+            self.taxref_cd_noms.setdefault(ct_sp_id, cd_nom)
+        for taxon_key in taxon_keys:
+            self.taxref_cd_noms.setdefault(taxon_key, None)
+
+    def fetch_taxref_cd_nom(self):
+        taxon_key = self.data.get("taxonKey")
+        if taxon_key is None:
+            return None
+        taxon_key = str(taxon_key)
+        if taxon_key not in self.taxref_cd_noms:
+            self.load_taxref_cd_noms([taxon_key])
+        cd_nom = self.taxref_cd_noms.get(taxon_key)
+        if not cd_nom:
+            count, name = self.unknown_taxon_keys.get(taxon_key, (0, None))
+            self.unknown_taxon_keys[taxon_key] = (
+                count + 1,
+                name or self.data.get("scientificName"),
+            )
+        return cd_nom
+
+    def print_taxref_report(self):
+        if not self.unknown_taxon_keys:
+            return
+        nb_occurrences = sum(count for count, _name in self.unknown_taxon_keys.values())
+        click.secho(
+            f"{nb_occurrences} occurrence(s) skipped, no TAXREF link for "
+            f"{len(self.unknown_taxon_keys)} GBIF taxonKey(s) :",
+            fg="yellow",
+        )
+        most_common = sorted(
+            self.unknown_taxon_keys.items(), key=lambda item: -item[1][0]
+        )
+        for taxon_key, (count, name) in most_common[:20]:
+            click.secho(f"  {taxon_key} ({name}) : {count}", fg="yellow")
+        if len(most_common) > 20:
+            click.secho(f"  ... and {len(most_common) - 20} more", fg="yellow")
 
     @property
     def items(self):
@@ -240,7 +720,8 @@ class GBIFParser(JSONParser):
 
     @property
     def total(self):
-        return len(self.row_data)  # Nombre total d'occurrences
+        # known after the first search request
+        return getattr(self, "_total", None)
 
     def get_geom(self, row):
         if "decimalLatitude" in row and "decimalLongitude" in row:
@@ -254,42 +735,85 @@ class GBIFParser(JSONParser):
             )
         return None
 
-    def next_row(self):
-        for occurrence_id, data in self.row_data.items():
+    def get_geoms(self, rows):
+        return self.points_from_xy(
+            [row.get("decimalLongitude") for row in rows],
+            [row.get("decimalLatitude") for row in rows],
+        )
+
+    def next_page(self):
+        if self.partitioned and self.can_import and not self.is_download:
+            for cursor, page in self.iter_partitioned_pages(self.cursor):
+                self.cursor = cursor
+                yield self.prepare_page(page)
+            return
+        offset = self.cursor.get("offset", 0)
+        # downloads are read by batch, the search by page of the API
+        page_size = self.batch_size if self.is_download else self.limit
+        occurrences = self.iter_occurrences(offset)
+        while True:
+            page = list(islice(occurrences, page_size))
+            if not page:
+                break
+            offset += len(page)
+            self.cursor = {"offset": offset}
+            yield self.prepare_page(page)
+
+    def prepare_page(self, page):
+        """
+        Complete a page of GBIF occurrences (identifier, cd_nom, nomenclatures,
+        dataset and dates). Occurrences without cd_nom are dropped.
+        The taxonKeys of the page are resolved with one query and event dates
+        are parsed once per distinct value of the page (api2gn.dates)
+        """
+        rows = []
+        date_ranges, date_errors = parse_date_ranges(
+            data.get("eventDate") for _key, data in page
+        )
+        for event_date, e in date_errors.items():
+            click.secho(
+                f"[eventDate {event_date}] Could not get properly occurence date: {e}",
+                fg="red",
+            )
+        self.load_taxref_cd_noms(data.get("taxonKey") for _key, data in page)
+        if self.create_dataset:
+            self.resolve_datasets(
+                data.get("datasetKey")
+                for _key, data in page
+                if "id_dataset" not in data
+            )
+        for occurrence_id, data in page:
             self.counter += 1
             self.occurrence_id = occurrence_id
             self.data = data
             try:
-                from uuid import UUID
-
                 identifier = self.data["identifiers"][0]["identifier"]
                 self.data["identifier"] = UUID(identifier)
-            except (ValueError, KeyError):
+            except (ValueError, KeyError, IndexError, TypeError):
                 self.data["identifier"] = None
             self.data["cd_nom"] = self.fetch_taxref_cd_nom()
             nomeclature_key = ["sex", "lifeStage", "occurrenceStatus"]
             for key in nomeclature_key:
                 self.data[key] = self._get_cd_nomenclature(key, self.data.get(key))
 
-            if self.data["cd_nom"]:
-                if not "id_dataset" in self.data and self.create_dataset:
-                    id_dataset = self._test_dataset_uuid(self.data["datasetKey"])
-                    self.data.update({"id_dataset": id_dataset})
-
-                if "eventDate" in self.data:
-                    try:
-                        date_min, date_max = generate_date_range(self.data["eventDate"])
-                        self.data.update({"dateStart": date_min, "dateEnd": date_max})
-
-                    except ValueError as e:
-                        click.secho(
-                            f"[data #{self.occurrence_id}] Could not get properly occurence date: {e}",
-                            fg="red",
-                        )
-                    yield None
-                yield self.data
-            else:
-                yield None
+            if not self.data["cd_nom"]:
+                continue
+            if not "id_dataset" in self.data and self.create_dataset:
+                dataset_key = str(self.data.get("datasetKey"))
+                id_dataset = self.datasets_id.get(
+                    dataset_key, self.new_datasets_id.get(dataset_key)
+                )
+                if id_dataset is None:
+                    # dataset metadata could not be fetched
+                    continue
+                self.data.update({"id_dataset": id_dataset})
+
+            date_range = date_ranges.get(self.data.get("eventDate"))
+            if date_range:
+                date_min, date_max = date_range
+                self.data.update({"dateStart": date_min, "dateEnd": date_max})
+            rows.append(self.data)
+        return rows
 
     ### Mapping a améliorer
     mapping = {
@@ -1,4 +1,5 @@
 import click
+import shapely
 from geojson import Feature
 from sqlalchemy.sql import func
 from shapely import wkt
@@ -12,6 +13,9 @@ class GeoNatureParser(JSONParser):
     srid = 4326
     page_parameter = "offset"
     progress_bar = True
+    # filter_d_up_date_modification windows overlap: with load_mode = "merge"
+    # rows are upserted on the SINP uuid
+    upsert_keys = ("unique_id_sinp",)
 
     def __init__(self):
         self.api_filters = {**GeoNatureParser.api_filters, **self.api_filters}
@@ -41,6 +45,10 @@ class GeoNatureParser(JSONParser):
         geom = wkt.loads(row["wkt_4326"])
         return from_shape(geom, srid=4326)
 
+    def get_geoms(self, rows):
+        # one vectorized WKT parsing for the whole page
+        return shapely.from_wkt([row.get("wkt_4326") for row in rows])
+
     mapping = {
         "unique_id_sinp": "id_perm_sinp",
         "unique_id_sinp_grp": "id_perm_grp_sinp",
@@ -0,0 +1,159 @@
+"""
+Decoding of GML geometries without re-serialization.
+
+gml:Point, gml:LineString and gml:Polygon coordinates (pos, posList or
+coordinates) are read straight into numpy arrays and the geometries of a
+whole page are built at once with the shapely 2 vectorized constructors.
+Other geometry types, and anything the fast path cannot read, go through
+pygml.
+"""
+import xml.etree.ElementTree as ET
+
+import pygml
+import shapely
+from pygml.axisorder import is_crs_yx
+from shapely.geometry import shape
+
+from api2gn.mixins import SHAPELY_2, np
+
+GML_GEOMETRY_TYPES = ("Point", "LineString", "Polygon")
+
+
+def _localname(tag):
+    return tag.rpartition("}")[2]
+
+
+def find_gml_geometry(parent_tag):
+    """
+    Return the first Point, LineString or Polygon element under parent_tag
+    (in this order of preference), None if there is none
+    """
+    for geometry_type in GML_GEOMETRY_TYPES:
+        geometry_tag = parent_tag.find(".//{*}" + geometry_type)
+        if geometry_tag is not None:
+            return geometry_tag
+    return None
+
+
+def _is_yx(elem):
+    # pygml behaviour: the srsName of the geometry or of its positions
+    srs = elem.get("srsName")
+    if not srs:
+        srs = next(
+            (child.get("srsName") for child in elem.iter() if child.get("srsName")),
+            None,
+        )
+    if not srs:
+        return False
+    try:
+        return is_crs_yx(srs)
+    except ValueError:
+        return False
+
+
+def _coordinates(elem):
+    # GML 2 <coordinates cs="," ts=" " decimal=".">
+    if elem.get("decimal", ".") != ".":
+        raise ValueError("Unsupported decimal separator")
+    cs = elem.get("cs", ",")
+    ts = elem.get("ts", " ")
+    tuples = elem.text.split() if ts == " " else elem.text.strip().split(ts)
+    return np.array([t.split(cs) for t in tuples], dtype=float)
+
+
+def _positions(elem, dims):
+    """
+    Coordinates of a Point, LineString or LinearRing element as a
+    (n, 2) array in x/y order
+    """
+    children = list(elem)
+    name = _localname(children[0].tag)
+    if name == "posList":
+        dims = int(children[0].get("srsDimension") or dims)
+        coords = np.array(children[0].text.split(), dtype=float).reshape(-1, dims)
+    elif name == "pos":
+        coords = np.array([child.text.split() for child in children], dtype=float)
+    elif name == "coordinates":
+        coords = _coordinates(children[0])
+    else:
+        raise ValueError(f"Unsupported GML element {name}")
+    # the synthese stores 2D geometries
+    return coords[:, :2]
+
+
+def _parts(elem):
+    """
+    (geometry type, list of coordinate arrays) of a GML geometry element,
+    the first array of a Polygon is its exterior ring
+    """
+    name = _localname(elem.tag)
+    dims = int(elem.get("srsDimension") or 2)
+    if name in ("Point", "LineString"):
+        parts = [_positions(elem, dims)]
+    elif name == "Polygon":
+        # exterior / interior (GML 3), outerBoundaryIs / innerBoundaryIs (GML 2)
+        parts = [_positions(boundary[0], dims) for boundary in elem]
+    else:
+        raise ValueError(f"Unsupported GML geometry {name}")
+    if _is_yx(elem):
+        parts = [part[:, ::-1] for part in parts]
+    return name, parts
+
+
+def parse_with_pygml(elem):
+    geom = pygml.parse(ET.tostring(elem, encoding="unicode", method="xml"))
+    return shape(geom.geometry)
+
+
+def decode_gml(elements):
+    """
+    Build the shapely geometries of a list of GML geometry elements
+    (None is kept as None). Return an object array
+    """
+    geoms = np.full(len(elements), None, dtype=object)
+    decoded = {geometry_type: ([], []) for geometry_type in GML_GEOMETRY_TYPES}
+    for i, elem in enumerate(elements):
+        if elem is None:
+            continue
+        try:
+            name, parts = _parts(elem)
+        except (AttributeError, IndexError, TypeError, ValueError):
+            geoms[i] = parse_with_pygml(elem)
+            continue
+        indices, coords = decoded[name]
+        indices.append(i)
+        coords.append(parts)
+
+    indices, coords = decoded["Point"]
+    if indices:
+        geoms[indices] = shapely.points(np.vstack([parts[0] for parts in coords]))
+
+    indices, coords = decoded["LineString"]
+    if indices:
+        lines = [parts[0] for parts in coords]
+        geoms[indices] = shapely.linestrings(
+            np.vstack(lines),
+            indices=np.repeat(np.arange(len(lines)), [len(line) for line in lines]),
+        )
+
+    indices, coords = decoded["Polygon"]
+    if indices:
+        rings = [ring for parts in coords for ring in parts]
+        linearrings = shapely.linearrings(
+            np.vstack(rings),
+            indices=np.repeat(np.arange(len(rings)), [len(ring) for ring in rings]),
+        )
+        geoms[indices] = shapely.polygons(
+            linearrings,
+            indices=np.repeat(np.arange(len(coords)), [len(parts) for parts in coords]),
+        )
+    return geoms
+
+
+def gml_to_shape(elem):
+    """
+    Shapely geometry of a single GML geometry element
+    """
+    if not SHAPELY_2:
+        return parse_with_pygml(elem)
+    return decode_gml([elem])[0]
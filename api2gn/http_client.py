@@ -0,0 +1,255 @@
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class HostUnavailable(requests.ConnectionError):
+    """
+    Raised without any network call while the circuit breaker of a host is
+    open, `retry_after` is the number of seconds before it lets a request
+    through
+    """
+
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Rate limiter: at most `rate` requests per second, bursts up to `capacity`
+
+    Shared by all the threads (and parsers) of the process calling the same host.
+    `pause` blocks every caller until a date, e.g. when the host sent a
+    Retry-After header.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, self.rate))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    if self.rate > 0:
+                        self.tokens = min(
+                            self.capacity,
+                            self.tokens + (now - self.updated_at) * self.rate,
+                        )
+                    self.updated_at = now
+                    if self.rate <= 0 or self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, delay):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+class CircuitBreaker:
+    """
+    Fail fast when a host is down.
+
+    After `threshold` consecutive failures (connection error or 5xx) the
+    circuit opens: requests raise HostUnavailable during `cooldown` seconds.
+    Then one request is let through (half-open), its result closes the
+    circuit or opens it again.
+    """
+
+    def __init__(self, threshold=5, cooldown=60):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def check(self, host):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0:
+                raise HostUnavailable(
+                    f"{host} is unavailable ({self.failures} consecutive failures), "
+                    f"next try in {remaining:.0f}s",
+                    retry_after=remaining,
+                )
+            # half-open: let this request test the host
+            self.opened_at = time.monotonic()
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold and self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+# one rate limiter and one circuit breaker per host for the whole process
+_RATE_LIMITERS = {}
+_CIRCUIT_BREAKERS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_rate_limiter(host, rate):
+    with _REGISTRY_LOCK:
+        if host not in _RATE_LIMITERS:
+            _RATE_LIMITERS[host] = TokenBucket(rate)
+        return _RATE_LIMITERS[host]
+
+
+def get_circuit_breaker(host, threshold, cooldown):
+    with _REGISTRY_LOCK:
+        if host not in _CIRCUIT_BREAKERS:
+            _CIRCUIT_BREAKERS[host] = CircuitBreaker(threshold, cooldown)
+        return _CIRCUIT_BREAKERS[host]
+
+
+class HTTPClient:
+    """
+    HTTP session shared by all the connectors of a parser.
+
+    - connection pooling and keep-alive (one requests.Session)
+    - compressed transfer (gzip / deflate)
+    - transfer statistics: requests, bytes read from the network,
+      new / reused connections
+    - per host rate limiting (token bucket) and circuit breaker, shared by
+      every client of the process
+
+    Attributes:
+        pool_size(int): max connections kept alive per host
+        rate_limits(dict): host -> max requests per second, "*" for any
+            other host. Hosts without limit are not throttled
+        breaker_threshold(int): consecutive failures opening the circuit
+            of a host (0 to disable)
+        breaker_cooldown(int): seconds before a new request is sent to a
+            host whose circuit is open
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        rate_limits=None,
+        breaker_threshold=5,
+        breaker_cooldown=60,
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["Accept-Encoding"] = "gzip, deflate"
+        self._lock = threading.Lock()
+        self.nb_requests = 0
+        self.bytes_transferred = 0
+        self.rate_limits = dict(rate_limits or {})
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.nb_throttled = 0
+
+    def rate_limiter(self, url):
+        host = urlsplit(url).hostname
+        rate = self.rate_limits.get(host, self.rate_limits.get("*"))
+        if rate:
+            return get_rate_limiter(host, rate)
+        # unlimited host, but may have been paused by a Retry-After
+        return _RATE_LIMITERS.get(host)
+
+    def circuit_breaker(self, url):
+        return get_circuit_breaker(
+            urlsplit(url).hostname, self.breaker_threshold, self.breaker_cooldown
+        )
+
+    def throttle(self, url, delay):
+        """
+        Hold every request to the host of `url` for `delay` seconds
+        """
+        with self._lock:
+            self.nb_throttled += 1
+        limiter = self.rate_limiter(url) or get_rate_limiter(urlsplit(url).hostname, 0)
+        limiter.pause(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        breaker = self.circuit_breaker(url)
+        breaker.check(urlsplit(url).hostname)
+        limiter = self.rate_limiter(url)
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            breaker.failure()
+            raise
+        if response.status_code >= 500:
+            breaker.failure()
+        else:
+            breaker.success()
+
+        with self._lock:
+            self.nb_requests += 1
+            self.bytes_transferred += self._wire_size(response)
+        return response
+
+    def _wire_size(self, response):
+        if response.raw is not None and not response.raw.closed:
+            # streamed response: body not read yet
+            return int(response.headers.get("Content-Length") or 0)
+        try:
+            # bytes read from the socket, before decompression
+            return response.raw.tell()
+        except Exception:
+            return len(response.content or b"")
+
+    @property
+    def nb_connections(self):
+        nb_connections = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    nb_connections += pool.num_connections
+        return nb_connections
+
+    @property
+    def stats(self):
+        nb_connections = self.nb_connections
+        return {
+            "requests": self.nb_requests,
+            "bytes": self.bytes_transferred,
+            "connections": nb_connections,
+            "reused_connections": max(self.nb_requests - nb_connections, 0),
+            "throttled": self.nb_throttled,
+        }
+
+    def summary(self):
+        stats = self.stats
+        return (
+            f"HTTP : {stats['requests']} request(s), "
+            f"{stats['bytes'] / 1_000_000:.1f} MB transferred, "
+            f"{stats['connections']} connection(s) opened, "
+            f"{stats['reused_connections']} reused, "
+            f"{stats['throttled']} throttled"
+        )
@@ -0,0 +1,339 @@
+import io
+import json
+from datetime import date, datetime
+from uuid import UUID
+
+import click
+from sqlalchemy import inspect, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql import ClauseElement, literal_column
+from geoalchemy2.elements import WKBElement, WKTElement
+from geoalchemy2.shape import to_shape
+from shapely import wkb
+
+from geonature.core.gn_synthese.models import Synthese
+from geonature.utils.env import db
+
+
+# PostgreSQL cannot bind more than 65535 parameters in a single statement
+MAX_BIND_PARAMETERS = 32000
+
+
+class SyntheseLoader:
+    """
+    Gather mapped rows (dict of synthese column -> value) and write them by
+    batch in gn_synthese.synthese.
+
+    Rows containing only literal values are streamed with a PostgreSQL
+    `COPY ... FROM STDIN`. Rows embedding SQL expressions (nomenclature or
+    geometry functions) are written with a multi-row `INSERT ... VALUES`.
+
+    In "merge" mode rows are upserted with `INSERT ... ON CONFLICT` on
+    `conflict_keys`: existing rows are updated only if a value changed.
+    A unique index on `conflict_keys` is required.
+
+    Attributes:
+        batch_size(int): number of rows kept in memory before a flush
+        method(str): "copy" or "insert"
+        mode(str): "insert" or "merge"
+        conflict_keys(tuple): synthese columns identifying a row in merge mode
+        prepare(callable): called with the rows of a batch before writing
+            them (e.g. to reproject all their geometries at once)
+        dry_run(bool): build the batches but never write them
+    """
+
+    def __init__(
+        self,
+        batch_size=1000,
+        method="copy",
+        mode="insert",
+        conflict_keys=("id_source", "entity_source_pk_value"),
+        prepare=None,
+        dry_run=False,
+    ):
+        self.batch_size = batch_size
+        self.method = method
+        self.mode = mode
+        self.conflict_keys = tuple(conflict_keys)
+        self.prepare = prepare
+        self.dry_run = dry_run
+        self.table = Synthese.__table__
+        self.columns = {
+            attr.key: attr.columns[0] for attr in inspect(Synthese).column_attrs
+        }
+        # columns that are NULL when missing from a row: they can be filled
+        # with None so that the rows of a batch share a statement
+        self.nullable_keys = {
+            key
+            for key, column in self.columns.items()
+            if not column.primary_key
+            and column.default is None
+            and column.server_default is None
+        }
+        self.rows = []
+        self.nb_row_written = 0
+        self.nb_row_failed = 0
+        self.nb_row_inserted = 0
+        self.nb_row_updated = 0
+        self.nb_row_unchanged = 0
+        self._warned_merge_fallback = False
+
+    @staticmethod
+    def has_conflict_index(conflict_keys):
+        """
+        Check that the synthese has a unique index on exactly the columns of
+        `conflict_keys`: ON CONFLICT cannot be used without one
+        """
+        columns = {
+            attr.key: attr.columns[0].name for attr in inspect(Synthese).column_attrs
+        }
+        table = Synthese.__table__
+        return db.session.scalar(
+            text(
+                """
+                SELECT EXISTS (
+                    SELECT 1
+                    FROM pg_index i
+                    JOIN pg_class c ON c.oid = i.indrelid
+                    JOIN pg_namespace n ON n.oid = c.relnamespace
+                    WHERE n.nspname = :schema AND c.relname = :table
+                    AND i.indisunique AND i.indpred IS NULL
+                    AND i.indnkeyatts = cardinality(CAST(:columns AS text[]))
+                    AND (
+                        SELECT array_agg(a.attname::text ORDER BY a.attname::text)
+                        FROM pg_attribute a
+                        WHERE a.attrelid = c.oid AND a.attnum = ANY(i.indkey)
+                    ) = CAST(:columns AS text[])
+                )
+                """
+            ),
+            {
+                "schema": table.schema,
+                "table": table.name,
+                "columns": sorted(columns[key] for key in conflict_keys),
+            },
+        )
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, row):
+        """
+        Add a row to the current batch, flush it if the batch is full.
+        Return the number of rows written by the flush (0 if no flush).
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            return self.flush()
+        return 0
+
+    def extend(self, rows):
+        written = 0
+        for row in rows:
+            written += self.add(row)
+        return written
+
+    def flush(self):
+        """
+        Write the current batch in the database (without committing).
+        Return the number of written rows.
+        """
+        rows, self.rows = self.rows, []
+        if not rows or self.dry_run:
+            return 0
+        if self.prepare:
+            rows = self._prepare(rows)
+        # rows without the same columns cannot share a statement: columns
+        # missing from a row must keep their database default value, the
+        # others are filled with None
+        all_keys = set().union(*rows) & self.nullable_keys
+        groups = {}
+        for row in rows:
+            for key in all_keys.difference(row):
+                row[key] = None
+            groups.setdefault(tuple(sorted(row)), []).append(row)
+        written = 0
+        for keys, group in groups.items():
+            if (
+                self.mode == "merge"
+                and not set(self.conflict_keys) <= set(keys)
+                and not self._warned_merge_fallback
+            ):
+                self._warned_merge_fallback = True
+                click.secho(
+                    f"<loader> Rows without {', '.join(self.conflict_keys)} "
+                    "cannot be merged: they are inserted and may duplicate "
+                    "existing rows",
+                    fg="red",
+                    bold=True,
+                )
+            written += self._write(keys, group)
+        self.nb_row_written += written
+        return written
+
+    def _write(self, keys, rows):
+        """
+        Write rows sharing the same columns in a savepoint. If it fails, the
+        rows are written again by halves so that only the faulty rows are
+        lost. Return the number of written rows
+        """
+        counters = (self.nb_row_inserted, self.nb_row_updated, self.nb_row_unchanged)
+        try:
+            with db.session.begin_nested():
+                if self.mode == "merge" and set(self.conflict_keys) <= set(keys):
+                    self._merge(keys, rows)
+                elif self.method == "copy" and not self._has_sql_expression(rows):
+                    self._copy(keys, rows)
+                    self.nb_row_inserted += len(rows)
+                else:
+                    self._insert(keys, rows)
+                    self.nb_row_inserted += len(rows)
+            return len(rows)
+        except Exception as e:
+            # the merge counters of the rolled back statements
+            self.nb_row_inserted, self.nb_row_updated, self.nb_row_unchanged = counters
+            if len(rows) == 1:
+                self.nb_row_failed += 1
+                click.secho(f"<loader> Failed to write a row : {e}", fg="red")
+                return 0
+            click.secho(
+                f"<loader> Failed to write {len(rows)} rows ({e}), "
+                "written again by halves",
+                fg="yellow",
+            )
+        middle = len(rows) // 2
+        return self._write(keys, rows[:middle]) + self._write(keys, rows[middle:])
+
+    def _prepare(self, rows):
+        """
+        Call `prepare` on the batch, row by row if it fails so that only the
+        rows it cannot prepare (e.g. invalid geometry) are lost
+        """
+        try:
+            self.prepare(rows)
+            return rows
+        except click.ClickException:
+            # configuration error (missing dependency...), not a data error
+            raise
+        except Exception as e:
+            click.secho(
+                f"<loader> Failed to prepare the batch ({e}), row by row", fg="red"
+            )
+        prepared = []
+        for row in rows:
+            try:
+                self.prepare([row])
+            except Exception as e:
+                self.nb_row_failed += 1
+                click.secho(f"<loader> Failed to prepare a row : {e}", fg="red")
+                continue
+            prepared.append(row)
+        return prepared
+
+    def _has_sql_expression(self, rows):
+        return any(
+            isinstance(value, ClauseElement) for row in rows for value in row.values()
+        )
+
+    def _insert(self, keys, rows):
+        chunk_size = max(1, MAX_BIND_PARAMETERS // len(keys))
+        for i in range(0, len(rows), chunk_size):
+            db.session.execute(
+                self.table.insert().values(
+                    [
+                        {self.columns[key].name: row[key] for key in keys}
+                        for row in rows[i : i + chunk_size]
+                    ]
+                )
+            )
+
+    def _merge(self, keys, rows):
+        # ON CONFLICT cannot update the same row twice in a statement:
+        # only the last version of a duplicated row is kept
+        unique_rows = {}
+        for i, row in enumerate(rows):
+            conflict_value = tuple(row[key] for key in self.conflict_keys)
+            if None in conflict_value:
+                conflict_value = i
+            unique_rows[conflict_value] = row
+        self.nb_row_unchanged += len(rows) - len(unique_rows)
+        rows = list(unique_rows.values())
+
+        conflict_cols = [self.columns[key].name for key in self.conflict_keys]
+        update_cols = [
+            self.columns[key].name for key in keys if key not in self.conflict_keys
+        ]
+        chunk_size = max(1, MAX_BIND_PARAMETERS // len(keys))
+        for i in range(0, len(rows), chunk_size):
+            chunk = rows[i : i + chunk_size]
+            stmt = pg_insert(self.table).values(
+                [{self.columns[key].name: row[key] for key in keys} for row in chunk]
+            )
+            if update_cols:
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=conflict_cols,
+                    set_={col: stmt.excluded[col] for col in update_cols},
+                    # unchanged rows are skipped
+                    where=tuple_(
+                        *[self.table.c[col] for col in update_cols]
+                    ).is_distinct_from(
+                        tuple_(*[stmt.excluded[col] for col in update_cols])
+                    ),
+                )
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=conflict_cols)
+            # xmax = 0 for a freshly inserted row
+            results = db.session.execute(
+                stmt.returning(literal_column("xmax = 0"))
+            ).fetchall()
+            nb_inserted = sum(1 for (inserted,) in results if inserted)
+            self.nb_row_inserted += nb_inserted
+            self.nb_row_updated += len(results) - nb_inserted
+            self.nb_row_unchanged += len(chunk) - len(results)
+
+    def _copy(self, keys, rows):
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write("\t".join(self._copy_value(row[key]) for key in keys))
+            buffer.write("\n")
+        buffer.seek(0)
+        sql = "COPY {}.{} ({}) FROM STDIN".format(
+            self.table.schema,
+            self.table.name,
+            ", ".join('"{}"'.format(self.columns[key].name) for key in keys),
+        )
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(sql, buffer)
+        finally:
+            cursor.close()
+
+    def _copy_value(self, value):
+        """
+        Serialize a python value in the PostgreSQL COPY text format
+        """
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        if isinstance(value, WKBElement):
+            # EWKB so the column SRID constraint is satisfied
+            if value.extended:
+                return value.desc
+            return wkb.dumps(to_shape(value), hex=True, srid=value.srid)
+        if isinstance(value, WKTElement):
+            value = "SRID={};{}".format(value.srid, value.data)
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value, default=str)
+        elif isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, UUID):
+            return str(value)
+        else:
+            value = str(value)
+        return (
+            value.replace("\\", "\\\\")
+            .replace("\t", "\\t")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+        )
@@ -0,0 +1,37 @@
+"""cd_nom cache
+
+Revision ID: 8b3f5e2c9a41
+Revises: cd6d1b1f4118
+Create Date: 2026-10-17 14:21:07.613902
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8b3f5e2c9a41"
+down_revision = "cd6d1b1f4118"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+            CREATE TABLE api2gn.cd_nom_cache (
+                name varchar NOT NULL PRIMARY KEY,
+                cd_nom integer,
+                taxref_version varchar,
+                resolved_at timestamp NOT NULL DEFAULT now()
+            );
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        """
+            DROP TABLE api2gn.cd_nom_cache;
+        """
+    )
@@ -0,0 +1,102 @@
+"""synthese upsert index
+
+Revision ID: cd6d1b1f4118
+Revises: f6db15a3852d
+Create Date: 2026-10-17 10:03:48.218356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "cd6d1b1f4118"
+down_revision = "f6db15a3852d"
+branch_labels = None
+depends_on = None
+
+
+# unique indexes used by the merge load mode (INSERT ... ON CONFLICT)
+INDEXES = {
+    "i_api2gn_synthese_source_pk": ("id_source", "entity_source_pk_value"),
+    "i_api2gn_synthese_unique_id_sinp": ("unique_id_sinp",),
+}
+
+
+def has_unique_index(conn, columns):
+    """
+    A valid unique index on exactly these columns already exists
+    """
+    return conn.scalar(
+        sa.text(
+            """
+            SELECT EXISTS (
+                SELECT 1
+                FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indrelid
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = 'gn_synthese' AND c.relname = 'synthese'
+                AND i.indisunique AND i.indisvalid AND i.indpred IS NULL
+                AND i.indnkeyatts = cardinality(CAST(:columns AS text[]))
+                AND (
+                    SELECT array_agg(a.attname::text ORDER BY a.attname::text)
+                    FROM pg_attribute a
+                    WHERE a.attrelid = c.oid AND a.attnum = ANY(i.indkey)
+                ) = CAST(:columns AS text[])
+            )
+            """
+        ),
+        {"columns": sorted(columns)},
+    )
+
+
+def count_duplicates(conn, columns):
+    return conn.scalar(
+        sa.text(
+            """
+            SELECT count(*) FROM (
+                SELECT 1 FROM gn_synthese.synthese
+                WHERE {not_null}
+                GROUP BY {columns}
+                HAVING count(*) > 1
+            ) AS duplicates
+            """.format(
+                not_null=" AND ".join(f"{column} IS NOT NULL" for column in columns),
+                columns=", ".join(columns),
+            )
+        )
+    )
+
+
+def upgrade():
+    conn = op.get_bind()
+    to_create = {
+        name: columns
+        for name, columns in INDEXES.items()
+        if not has_unique_index(conn, columns)
+    }
+    for name, columns in to_create.items():
+        nb_duplicates = count_duplicates(conn, columns)
+        if nb_duplicates:
+            raise Exception(
+                f"api2gn : {nb_duplicates} valeur(s) de ({', '.join(columns)}) "
+                "en doublon dans gn_synthese.synthese, l'index unique "
+                f"{name} ne peut pas être créé. Supprimez les doublons puis "
+                "relancez `geonature db upgrade api2gn@head`"
+            )
+    # CONCURRENTLY: the synthese stays writable while the indexes are built,
+    # it cannot run in a transaction
+    with op.get_context().autocommit_block():
+        for name, columns in to_create.items():
+            # invalid index left by an interrupted build
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS gn_synthese.{name}")
+            op.execute(
+                f"CREATE UNIQUE INDEX CONCURRENTLY {name} "
+                f"ON gn_synthese.synthese ({', '.join(columns)})"
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS gn_synthese.{name}")
@@ -0,0 +1,36 @@
+"""parser checkpoint
+
+Revision ID: f6db15a3852d
+Revises: e27e2994d3bd
+Create Date: 2026-10-16 09:12:31.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f6db15a3852d"
+down_revision = "e27e2994d3bd"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute(
+        """
+            ALTER TABLE api2gn.parser
+                ADD COLUMN checkpoint jsonb,
+                ADD COLUMN checkpoint_date timestamp;
+        """
+    )
+
+
+def downgrade():
+    op.execute(
+        """
+            ALTER TABLE api2gn.parser
+                DROP COLUMN checkpoint,
+                DROP COLUMN checkpoint_date;
+        """
+    )
@@ -1,11 +1,28 @@
+import click
+from sqlalchemy import bindparam, text
 from sqlalchemy.sql import func
 
 from geonature.utils.env import db
 from ref_geo.utils import get_local_srid
 
 from shapely.geometry import shape
+from geoalchemy2.elements import WKBElement
 from geoalchemy2.shape import from_shape
 
+import shapely
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    from pyproj import Transformer
+except ImportError:
+    Transformer = None
+
+# vectorized geometry functions (batch build and client-side reprojection)
+SHAPELY_2 = np is not None and hasattr(shapely, "from_wkb")
+
 
 class NomenclatureMixin:
     nomenclature_mapping = {
@@ -26,9 +43,95 @@ class NomenclatureMixin:
         "id_nomenclature_sex": "SEXE",
         "id_nomenclature_life_stage": "STADE_VIE",
     }
+    # (mnemonique type, cd_nomenclature) -> id_nomenclature, see load_nomenclatures
+    nomenclatures = None
+
+    def load_nomenclatures(self):
+        """
+        Preload every nomenclature of the types used in `nomenclature_mapping`
+        so rows are resolved in python instead of one
+        `ref_nomenclatures.get_id_nomenclature` call per field and per row
+        """
+        for gn_col in getattr(self, "mapping", {}):
+            if (
+                gn_col.startswith("id_nomenclature")
+                and gn_col not in self.nomenclature_mapping
+            ):
+                click.secho(
+                    f"\nCannot find a nomenclature mnemonique type for `{gn_col}` - Please update the `nomenclature_mapping` class attribute",
+                    fg="red",
+                )
+                raise click.ClickException("Stop import")
+        types = set(self.nomenclature_mapping.values())
+        results = db.session.execute(
+            text(
+                """
+                SELECT t.mnemonique, n.cd_nomenclature, n.id_nomenclature
+                FROM ref_nomenclatures.t_nomenclatures n
+                JOIN ref_nomenclatures.bib_nomenclatures_types t ON t.id_type = n.id_type
+                WHERE t.mnemonique IN :types
+                """
+            ).bindparams(bindparam("types", expanding=True)),
+            {"types": list(types)},
+        )
+        self.nomenclatures = {
+            (mnemonique, cd_nomenclature): id_nomenclature
+            for mnemonique, cd_nomenclature, id_nomenclature in results
+        }
+        self.unknown_nomenclatures = {}
+        missing_types = types - {mnemonique for mnemonique, _ in self.nomenclatures}
+        if missing_types:
+            click.secho(
+                f"Nomenclature type(s) without values in ref_nomenclatures : {missing_types}",
+                fg="yellow",
+            )
+
+    def get_id_nomenclature(self, gn_col, cd_nomenclature):
+        """
+        Return the id_nomenclature of a code for a synthese column.
+        Unknown codes return None and are gathered in `unknown_nomenclatures`
+        """
+        if self.nomenclatures is None:
+            self.load_nomenclatures()
+        mnemonique = self.nomenclature_mapping[gn_col]
+        try:
+            return self.nomenclatures[(mnemonique, str(cd_nomenclature))]
+        except KeyError:
+            self.unknown_nomenclatures.setdefault(mnemonique, set()).add(
+                cd_nomenclature
+            )
+            return None
+
+    def print_nomenclature_report(self):
+        if not self.unknown_nomenclatures:
+            return
+        click.secho(
+            "Unknown nomenclature codes (default value used) :",
+            fg="yellow",
+        )
+        for mnemonique, codes in sorted(self.unknown_nomenclatures.items()):
+            click.secho(
+                f"  {mnemonique} : {', '.join(sorted(map(str, codes)))}",
+                fg="yellow",
+            )
 
 
 class GeometryMixin:
+    """
+    Fill the_geom_local, the_geom_4326 and the_geom_point from the parser geom.
+
+    By default the reprojection is done by PostGIS (st_transform SQL
+    expressions in each row). With `client_reprojection` only the source
+    geometry is set by `fill_dict_with_geom` and `reproject_batch` fills the
+    three columns of a whole batch with vectorized pyproj/shapely transforms.
+
+    `fill_geoms` is the page level counterpart of `fill_dict_with_geom`, it
+    takes an array of shapely geometries (see `JSONParser.build_objects`).
+    """
+
+    client_reprojection = False
+    _transformers = {}
+
     def build_geom_local(self, geom_4326, srid):
         return func.st_transform(func.st_setsrid(geom_4326, 4326), srid)
 
@@ -48,17 +151,132 @@ class GeometryMixin:
 
     def fill_dict_with_geom(self, synthese_dict, wkb_geom):
         synthese_dict[self.geometry_col] = wkb_geom
+        if self.client_reprojection:
+            # the_geom_4326 / the_geom_point are filled by reproject_batch
+            return synthese_dict
         if self.geometry_col == "the_geom_local":
-
-
             synthese_dict["the_geom_4326"] = self.build_geom_4326(wkb_geom, self.srid)
-            synthese_dict["the_geom_local"] = self.build_geom_local(wkb_geom, self.local_srid)
+            synthese_dict["the_geom_point"] = self.build_centroid_4326_from_local(
+                wkb_geom, self.srid
+            )
         elif self.geometry_col == "the_geom_4326":
             synthese_dict["the_geom_local"] = self.build_geom_local(wkb_geom, self.local_srid
 )
             synthese_dict["the_geom_point"] = self.build_centroid_from_4326(wkb_geom)
         return synthese_dict
 
+    def _get_transformer(self, from_srid, to_srid):
+        key = (from_srid, to_srid)
+        if key not in self._transformers:
+            self._transformers[key] = Transformer.from_crs(
+                f"EPSG:{from_srid}", f"EPSG:{to_srid}", always_xy=True
+            )
+        return self._transformers[key]
+
+    def transform_geoms(self, geoms, from_srid, to_srid):
+        """
+        Reproject an array of shapely geometries with a single pyproj call
+        over all their coordinates
+        """
+        if from_srid == to_srid:
+            return geoms
+        transformer = self._get_transformer(from_srid, to_srid)
+
+        def _transform(coords):
+            x, y = transformer.transform(coords[:, 0], coords[:, 1])
+            return np.column_stack((x, y))
+
+        return shapely.transform(geoms, _transform)
+
+    def points_from_xy(self, xs, ys):
+        """
+        Build an array of shapely points from two coordinate columns,
+        None where a coordinate is missing
+        """
+        xs = np.array([np.nan if x is None else x for x in xs], dtype=float)
+        ys = np.array([np.nan if y is None else y for y in ys], dtype=float)
+        geoms = np.full(len(xs), None, dtype=object)
+        valid = ~(np.isnan(xs) | np.isnan(ys))
+        geoms[valid] = shapely.points(xs[valid], ys[valid])
+        return geoms
+
+    def fill_geoms(self, synthese_dicts, geoms):
+        """
+        Fill the geometry columns of a block of rows from an array of shapely
+        geometries in the parser srid (None when the row has no geometry)
+        """
+        geoms = np.asarray(geoms, dtype=object)
+        missing = shapely.is_missing(geoms)
+        if missing.any():
+            click.secho(f"!!! No geom for {missing.sum()} row(s)", fg="red")
+        if self.client_reprojection:
+            self._fill_reprojected(
+                [row for row, miss in zip(synthese_dicts, missing) if not miss],
+                geoms[~missing],
+            )
+            return synthese_dicts
+        for synthese_dict, ewkb in zip(synthese_dicts, self._to_ewkb(geoms, self.srid)):
+            if ewkb is not None:
+                self.fill_dict_with_geom(
+                    synthese_dict, WKBElement(ewkb, srid=self.srid, extended=True)
+                )
+        return synthese_dicts
+
+    def reproject_batch(self, rows):
+        """
+        Fill the three synthese geometry columns of the rows built with
+        `client_reprojection` (rows with a source geom but no the_geom_point)
+        """
+        rows = [
+            row
+            for row in rows
+            if row.get(self.geometry_col) is not None and "the_geom_point" not in row
+        ]
+        if not rows:
+            return rows
+        if not SHAPELY_2:
+            raise click.ClickException(
+                "client_reprojection needs numpy, pyproj and shapely >= 2"
+            )
+        geoms = shapely.from_wkb(
+            [self._wkb_data(row[self.geometry_col]) for row in rows]
+        )
+        self._fill_reprojected(rows, geoms)
+        return rows
+
+    def _wkb_data(self, wkb_element):
+        data = wkb_element.data
+        return data if isinstance(data, str) else bytes(data)
+
+    def _fill_reprojected(self, rows, geoms):
+        if Transformer is None or not SHAPELY_2:
+            raise click.ClickException(
+                "client_reprojection needs numpy, pyproj and shapely >= 2"
+            )
+        geoms_4326 = self.transform_geoms(geoms, self.srid, 4326)
+        geoms_local = self.transform_geoms(geoms, self.srid, self.local_srid)
+        points = shapely.centroid(geoms_4326)
+        for row, geom_4326, geom_local, point in zip(
+            rows,
+            self._to_ewkb(geoms_4326, 4326),
+            self._to_ewkb(geoms_local, self.local_srid),
+            self._to_ewkb(points, 4326),
+        ):
+            row["the_geom_4326"] = WKBElement(geom_4326, srid=4326, extended=True)
+            row["the_geom_local"] = WKBElement(
+                geom_local, srid=self.local_srid, extended=True
+            )
+            row["the_geom_point"] = WKBElement(point, srid=4326, extended=True)
+
+    def _to_ewkb(self, geoms, srid):
+        # hex EWKB can be sent as is by the COPY loader
+        return shapely.to_wkb(
+            shapely.set_srid(geoms, srid), hex=True, include_srid=True
+        )
+
     @property
     def local_srid(self):
-        return get_local_srid(db.session)
+        # cached: the parser geom columns are filled for every row
+        if not hasattr(self, "_local_srid"):
+            self._local_srid = get_local_srid(db.session)
+        return self._local_srid
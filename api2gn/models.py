@@ -1,3 +1,5 @@
+from sqlalchemy.dialects.postgresql import JSONB
+
 from geonature.utils.env import DB
 
 
@@ -12,3 +14,20 @@ class ParserModel(DB.Model):
     nb_row_last_import = DB.Column(DB.Integer)
     nb_row_last_import = DB.Column(DB.Integer)
     schedule_frequency = DB.Column(DB.Integer)
+    # cursor of the last committed batch (page, offset, startIndex...)
+    checkpoint = DB.Column(JSONB)
+    checkpoint_date = DB.Column(DB.DateTime)
+
+
+class CdNomCacheModel(DB.Model):
+    """
+    Persistent name -> cd_nom resolutions of the name-based parsers,
+    cd_nom is NULL for the names that could not be resolved
+    """
+
+    __tablename__ = "cd_nom_cache"
+    __table_args__ = {"schema": "api2gn"}
+    name = DB.Column(DB.Unicode, primary_key=True)
+    cd_nom = DB.Column(DB.Integer)
+    taxref_version = DB.Column(DB.Unicode)
+    resolved_at = DB.Column(DB.DateTime, server_default=DB.func.now())
@@ -0,0 +1,238 @@
+"""
+Declarative WFS filters.
+
+A filter is a list of conditions (property, operator, value), the bbox
+condition being (geometry property, "bbox", (xmin, ymin, xmax, ymax, srid)).
+Conditions are translated into an OGC Filter Encoding document (FILTER
+parameter) or a CQL_FILTER expression, or evaluated client side on the
+features when the server cannot.
+"""
+
+import operator as op
+import re
+from datetime import date, datetime
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+FES_OPERATORS = {
+    "=": "PropertyIsEqualTo",
+    "!=": "PropertyIsNotEqualTo",
+    "<": "PropertyIsLessThan",
+    "<=": "PropertyIsLessThanOrEqualTo",
+    ">": "PropertyIsGreaterThan",
+    ">=": "PropertyIsGreaterThanOrEqualTo",
+    "like": "PropertyIsLike",
+}
+CQL_OPERATORS = {
+    "=": "=",
+    "!=": "<>",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+    "like": "LIKE",
+}
+COMPARATORS = {
+    "=": op.eq,
+    "!=": op.ne,
+    "<": op.lt,
+    "<=": op.le,
+    ">": op.gt,
+    ">=": op.ge,
+}
+
+
+def parse_filters(filters, geometry_property, srid, last_import=None):
+    """
+    Turn the `filters` attribute of a parser into a list of conditions
+
+    filters = {
+        "bbox": (xmin, ymin, xmax, ymax),  # in the srid of the layer
+        "properties": {
+            "code": "A",  # equality
+            "codes": ["A", "B"],  # one of the values
+            "date_obs": {">=": "2020-01-01", "<": "2021-01-01"},
+            "name": {"like": "Quercus%"},
+        },
+        "since_last_import": "date_modif",  # > date of the last import
+    }
+    """
+    conditions = []
+    if filters.get("bbox"):
+        if not geometry_property:
+            raise ValueError(
+                "a bbox filter needs the geometry property of the layer "
+                "(mapping of the geometry column)"
+            )
+        conditions.append((geometry_property, "bbox", (*filters["bbox"][:4], srid)))
+    for prop, value in (filters.get("properties") or {}).items():
+        if isinstance(value, dict):
+            for operator, operand in value.items():
+                if operator not in FES_OPERATORS:
+                    raise ValueError(f"Unknown filter operator {operator} on {prop}")
+                conditions.append((prop, operator, operand))
+        elif isinstance(value, (list, tuple, set)):
+            if not value:
+                # an empty filter is not valid Filter Encoding
+                raise ValueError(f"Empty list of values on {prop}")
+            conditions.append((prop, "in", list(value)))
+        else:
+            conditions.append((prop, "=", value))
+    if filters.get("since_last_import") and last_import:
+        conditions.append((filters["since_last_import"], ">", last_import))
+    return conditions
+
+
+def _literal(value):
+    if isinstance(value, datetime):
+        return value.isoformat(timespec="seconds")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def to_fes(conditions, wfs_version):
+    """
+    OGC Filter document: FES 2.0 for WFS 2.0, Filter Encoding 1.1 for
+    WFS 1.1 and 1.0 for WFS 1.0
+    """
+    if wfs_version.startswith("2."):
+        fes_ns, gml_ns, reference = (
+            "http://www.opengis.net/fes/2.0",
+            "http://www.opengis.net/gml/3.2",
+            "ValueReference",
+        )
+    else:
+        fes_ns, gml_ns, reference = (
+            "http://www.opengis.net/ogc",
+            "http://www.opengis.net/gml",
+            "PropertyName",
+        )
+
+    def comparison(prop, operator, value):
+        attributes = ""
+        if operator == "like":
+            # Filter Encoding 1.0 names the escape character "escape"
+            escape_attribute = "escape" if wfs_version == "1.0.0" else "escapeChar"
+            attributes = f' wildCard="%" singleChar="_" {escape_attribute}="\\"'
+        return (
+            f"<fes:{FES_OPERATORS[operator]}{attributes}>"
+            f"<fes:{reference}>{escape(prop)}</fes:{reference}>"
+            f"<fes:Literal>{escape(_literal(value))}</fes:Literal>"
+            f"</fes:{FES_OPERATORS[operator]}>"
+        )
+
+    predicates = []
+    for prop, operator, value in conditions:
+        if operator == "bbox":
+            xmin, ymin, xmax, ymax, srid = value
+            if wfs_version == "1.0.0":
+                envelope = (
+                    f'<gml:Box srsName="EPSG:{srid}">'
+                    f"<gml:coordinates>{xmin},{ymin} {xmax},{ymax}</gml:coordinates>"
+                    "</gml:Box>"
+                )
+            else:
+                envelope = (
+                    f'<gml:Envelope srsName="EPSG:{srid}">'
+                    f"<gml:lowerCorner>{xmin} {ymin}</gml:lowerCorner>"
+                    f"<gml:upperCorner>{xmax} {ymax}</gml:upperCorner>"
+                    "</gml:Envelope>"
+                )
+            predicates.append(
+                f"<fes:BBOX><fes:{reference}>{escape(prop)}</fes:{reference}>"
+                f"{envelope}</fes:BBOX>"
+            )
+        elif operator == "in":
+            equals = "".join(comparison(prop, "=", v) for v in value)
+            predicates.append(
+                f"<fes:Or>{equals}</fes:Or>" if len(value) > 1 else equals
+            )
+        else:
+            predicates.append(comparison(prop, operator, value))
+    if len(predicates) > 1:
+        body = f"<fes:And>{''.join(predicates)}</fes:And>"
+    else:
+        body = predicates[0]
+    return f'<fes:Filter xmlns:fes="{fes_ns}" xmlns:gml="{gml_ns}">{body}</fes:Filter>'
+
+
+def _cql_literal(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'{}'".format(_literal(value).replace("'", "''"))
+
+
+def to_cql(conditions):
+    """
+    CQL_FILTER expression (GeoServer vendor parameter)
+    """
+    predicates = []
+    for prop, operator, value in conditions:
+        if operator == "bbox":
+            xmin, ymin, xmax, ymax, srid = value
+            predicates.append(
+                f"BBOX({prop}, {xmin}, {ymin}, {xmax}, {ymax}, 'EPSG:{srid}')"
+            )
+        elif operator == "in":
+            predicates.append(
+                f"{prop} IN ({', '.join(_cql_literal(v) for v in value)})"
+            )
+        else:
+            predicates.append(f"{prop} {CQL_OPERATORS[operator]} {_cql_literal(value)}")
+    return " AND ".join(predicates)
+
+
+def _comparable(feature_value, value):
+    """
+    Cast the value read in a feature (text in GML) like the filter value
+    """
+    if isinstance(value, bool):
+        return str(feature_value).lower() in ("true", "1"), value
+    if isinstance(value, (int, float)):
+        return float(feature_value), value
+    return str(feature_value), _literal(value)
+
+
+@lru_cache(maxsize=128)
+def _like(pattern):
+    regex = "".join(
+        ".*" if char == "%" else "." if char == "_" else re.escape(char)
+        for char in pattern
+    )
+    return re.compile(regex + r"\Z", re.DOTALL)
+
+
+def match(conditions, get_value):
+    """
+    Client side evaluation of property conditions (bbox excluded):
+    get_value(property) returns the value of the feature
+    """
+    for prop, operator, value in conditions:
+        if operator == "bbox":
+            continue
+        feature_value = get_value(prop)
+        if feature_value is None:
+            return False
+        try:
+            if operator == "in":
+                if not any(_equals(feature_value, v) for v in value):
+                    return False
+                continue
+            if operator == "like":
+                if not _like(str(value)).match(str(feature_value)):
+                    return False
+                continue
+            left, right = _comparable(feature_value, value)
+            if not COMPARATORS[operator](left, right):
+                return False
+        except (TypeError, ValueError):
+            return False
+    return True
+
+
+def _equals(feature_value, value):
+    left, right = _comparable(feature_value, value)
+    return left == right
@@ -1,28 +1,45 @@
-import requests
+import json
+import math
+import random
 import xml.etree.ElementTree as ET
-import pygml
 from time import sleep
 
 
 from datetime import datetime
 import click
+import requests
 
 from tqdm import tqdm
-from sqlalchemy.sql import func
-from shapely.geometry import shape
-from geoalchemy2.shape import from_shape
+import shapely
+from shapely.geometry import box, shape
+from geoalchemy2.shape import from_shape, to_shape
 
 from geonature.core.gn_synthese.models import Synthese
 from geonature.utils.env import db
 from geonature.utils.config import config
 
 from api2gn.schema import MappingValidator
-from api2gn.mixins import GeometryMixin, NomenclatureMixin
+from api2gn.mixins import GeometryMixin, NomenclatureMixin, SHAPELY_2, np
 from api2gn.models import ParserModel
+from api2gn.loader import SyntheseLoader
+from api2gn.gml import decode_gml, find_gml_geometry, gml_to_shape
+from api2gn.http_client import HTTPClient, HostUnavailable
+from api2gn import ogc_filter
+from api2gn.utils import geojson_srid, iter_concurrent, parse_retry_after
 
 
 module_config = config["API2GN"]
 
+# XML tag ("{namespace}name") -> local name
+_LOCALNAMES = {}
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 
 class Parser(GeometryMixin, NomenclatureMixin):
     """
@@ -30,6 +47,20 @@ class Parser(GeometryMixin, NomenclatureMixin):
         mapping(dict): TODO
         constant_fields(dict): TODO
         dynamic_fields(dict): TODO
+        bulk_load(bool): write rows by batch with the SyntheseLoader instead
+            of one ORM Synthese object per row
+        batch_size(int): number of rows sent to the database at once
+        commit_every(int): commit the transaction every N imported rows
+        load_method(str): "copy" (COPY FROM STDIN) or "insert" (multi-row INSERT)
+        load_mode(str): "insert" or "merge" (upsert on `upsert_keys`, safe
+            for overlapping incremental imports)
+        upsert_keys(tuple): synthese columns identifying a row in merge mode
+        client_reprojection(bool): reproject each batch in python
+            (pyproj/shapely) instead of st_transform in every inserted row
+        cursor(dict): position of the last row yielded by next_row, saved
+            as the parser checkpoint on each commit
+        plan(callable): row -> synthese dict transform compiled from the
+            mapping by `compile_plan` at the start of the run
     """
 
     name: str
@@ -46,6 +77,14 @@ class Parser(GeometryMixin, NomenclatureMixin):
     page_parameter = "page"
     limit_parameter = "limit"
     counter = 0
+    bulk_load = False
+    batch_size = module_config["PARSER_BATCH_SIZE"]
+    commit_every = module_config["PARSER_COMMIT_EVERY"]
+    load_method = module_config["PARSER_LOAD_METHOD"]
+    load_mode = module_config["PARSER_LOAD_MODE"]
+    upsert_keys = ("id_source", "entity_source_pk_value")
+    client_reprojection = module_config["PARSER_CLIENT_REPROJECTION"]
+    plan = None
 
     def __init__(
         self,
@@ -54,6 +93,7 @@ class Parser(GeometryMixin, NomenclatureMixin):
             "the_geom_local" if self.local_srid == self.srid else "the_geom_4326"
         )
         self.parser_obj = self._get_or_create_parser()
+        self.cursor = {}
         self.validate_maping()
 
     def validate_maping(self):
@@ -79,22 +119,74 @@ class Parser(GeometryMixin, NomenclatureMixin):
             db.session.commit()
         return parser
 
-    def request_or_retry(self, url, **kwargs):
-        try_get = module_config["PARSER_NUMBER_OF_TRIES"]
-        assert try_get > 0
-        while try_get:
-            response = requests.get(url, allow_redirects=True, **kwargs)
-            if response.status_code in module_config["PARSER_RETRY_HTTP_STATUS"]:
-                click.info("Failed to fetch url {}. Retrying ...".format(url))
-                sleep(module_config["PARSER_RETRY_SLEEP_TIME"])
-                try_get -= 1
-            elif response.status_code == 200:
-                return response
+    @property
+    def http(self):
+        """
+        Pooled keep-alive HTTP client shared by every request of the parser
+        """
+        if getattr(self, "_http", None) is None:
+            self._http = HTTPClient(
+                pool_size=module_config["PARSER_HTTP_POOL_SIZE"],
+                rate_limits=module_config["PARSER_RATE_LIMITS"],
+                breaker_threshold=module_config["PARSER_CIRCUIT_BREAKER_THRESHOLD"],
+                breaker_cooldown=module_config["PARSER_CIRCUIT_BREAKER_COOLDOWN"],
+            )
+        return self._http
+
+    def request_or_retry(self, url, method="GET", **kwargs):
+        """
+        Send a request, retry on PARSER_RETRY_HTTP_STATUS and connection errors
+        with an exponential backoff (with jitter) or the delay asked by the
+        server in a Retry-After header. While the circuit breaker of the host
+        is open, the next try waits for the end of its cooldown
+        """
+        nb_tries = module_config["PARSER_NUMBER_OF_TRIES"]
+        assert nb_tries > 0
+        response = None
+        error = None
+        for attempt in range(nb_tries):
+            try:
+                response = self.http.request(
+                    method, url, allow_redirects=True, **kwargs
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response, error = None, e
             else:
+                if response.status_code == 200:
+                    return response
+                if (
+                    response.status_code
+                    not in module_config["PARSER_RETRY_HTTP_STATUS"]
+                ):
+                    break
+            if attempt == nb_tries - 1:
                 break
+            if isinstance(error, HostUnavailable) and response is None:
+                # no request was sent: wait until the circuit lets one through
+                delay = error.retry_after
+            else:
+                delay = self._retry_delay(attempt, response)
+            if response is not None and response.headers.get("Retry-After"):
+                # the whole host is throttled, not only this thread
+                self.http.throttle(url, delay)
+            click.secho(
+                "Failed to fetch url {} ({}). Retrying in {:.1f}s ...".format(
+                    url,
+                    response.status_code if response is not None else error,
+                    delay,
+                ),
+                fg="yellow",
+            )
+            sleep(delay)
+        if response is None:
+            raise click.ClickException(
+                "Failed to download {} after {} tries : {}".format(
+                    url, nb_tries, error
+                )
+            )
         click.secho(
             "Failed to fetch {} after {} times. Status code : {}.".format(
-                url, module_config["PARSER_NUMBER_OF_TRIES"], response.status_code
+                url, attempt + 1, response.status_code
             ),
             fg="red",
         )
@@ -104,14 +196,156 @@ class Parser(GeometryMixin, NomenclatureMixin):
             )
         )
 
+    def _retry_delay(self, attempt, response=None):
+        """
+        Delay before the next try : the Retry-After header if any, else
+        an exponential backoff with "equal jitter" capped at
+        PARSER_RETRY_MAX_SLEEP_TIME
+        """
+        max_delay = module_config["PARSER_RETRY_MAX_SLEEP_TIME"]
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                return min(retry_after, max_delay)
+        delay = min(module_config["PARSER_RETRY_SLEEP_TIME"] * 2**attempt, max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
     def next_row(self, page=0):
         raise NotImplemented
 
+    def next_page(self):
+        """
+        Yield the rows by page (list of rows). By default the rows of
+        `next_row` are grouped by `batch_size`
+        """
+        page = []
+        for row in self.next_row():
+            page.append(row)
+            if len(page) >= self.batch_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+    def _is_overridden_after(self, method, other):
+        """
+        Return True if `method` is redefined in a subclass of the class
+        defining `other` (e.g. a custom next_row on a parser whose
+        next_page does not use it)
+        """
+        mro = type(self).__mro__
+
+        def _index(name):
+            return next(i for i, klass in enumerate(mro) if name in vars(klass))
+
+        return _index(method) < _index(other)
+
+    def use_bulk_load(self):
+        """
+        Return True if the run can go through build_objects and the bulk
+        loader: a build_object redefined in a subclass (and not its
+        build_objects) is only called by the row by row path
+        """
+        return self.bulk_load and not self._is_overridden_after(
+            "build_object", "build_objects"
+        )
+
+    def iter_pages(self):
+        if self._is_overridden_after("next_row", "next_page"):
+            return Parser.next_page(self)
+        return self.next_page()
+
+    def build_objects(self, page):
+        """
+        Turn a page of rows into a block of synthese dicts for the bulk loader.
+        By default each row goes through `build_dict`
+        """
+        synthese_dicts = []
+        for row in page:
+            try:
+                synthese_dict = self.build_dict(row)
+            except Exception as e:
+                click.secho(f"<run> Build object error {e}", fg="red")
+                continue
+            if synthese_dict:
+                synthese_dicts.append(synthese_dict)
+        return synthese_dicts
+
     def build_object(self):
         raise NotImplemented
 
+    def build_dict(self, row):
+        """
+        Must return a dict synthese column -> value (used by the bulk loader)
+        """
+        raise NotImplemented
+
+    def compile_plan(self):
+        """
+        Must return a function row -> synthese dict (without geometry)
+        """
+        raise NotImplemented
+
+    def _split_mapping(self):
+        """
+        Validate the fields and resolve once which source fills each synthese
+        column: constant and dynamic fields win over the mapping, and mapping
+        keys named like an additional field are ignored
+        """
+        for gn_col, _func in self.dynamic_fields.items():
+            if not callable(_func):
+                raise click.ClickException(
+                    f"Dynamic field `{gn_col}` must be a function taking the row"
+                )
+        overridden = (
+            set(self.constant_fields)
+            | set(self.dynamic_fields)
+            | set(self.additionnal_fields)
+        )
+        mapping = [
+            (gn_col, field)
+            for gn_col, field in self.mapping.items()
+            if gn_col not in overridden
+        ]
+        if self.nomenclatures is None:
+            self.load_nomenclatures()
+        return mapping
+
     def insert(self, obj):
-        db.session.add(obj)
+        if self.bulk_load:
+            self.loader.add(obj)
+        else:
+            db.session.add(obj)
+
+    def prepare_batch(self, rows):
+        """
+        Called by the loader with the rows of a batch before they are written
+        """
+        if self.client_reprojection:
+            self.reproject_batch(rows)
+
+    def commit(self, dry_run=False):
+        """
+        Write the pending batch and commit it, return True if committed
+        """
+        if self.bulk_load:
+            self.loader.flush()
+        if dry_run:
+            return False
+        try:
+            # the checkpoint is committed with the batch it describes
+            self.parser_obj.checkpoint = dict(self.cursor)
+            self.parser_obj.checkpoint_date = datetime.now()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # the rows of the batch are lost: going on would move the
+            # checkpoint past them
+            raise click.ClickException(
+                f"<run> Commit changes error {e}: import stopped, run it "
+                "again with --resume to restart from the last checkpoint"
+            ) from e
+        return True
 
     def start(self):
         pass
@@ -119,39 +353,108 @@ class Parser(GeometryMixin, NomenclatureMixin):
     def end(self):
         pass
 
-    def save_history(self):
+    def save_history(self, dry_run=False):
+        if dry_run:
+            # nothing of a dry run is committed, the checkpoint is kept
+            db.session.rollback()
+            return
         try:
             self.parser_obj.last_import = datetime.now()
             self.parser_obj.nb_row_last_import = self.nb_row_imported
             self.parser_obj.nb_row_total = self.nb_row_imported + (
                 self.parser_obj.nb_row_total or 0
             )
+            self.parser_obj.checkpoint = None
+            self.parser_obj.checkpoint_date = None
             db.session.commit()
         except Exception as e:
             click.secho(f"<save_history> Error {e}", fg="red")
 
-    def run(self, dry_run=False):
+    def run(self, dry_run=False, resume=False):
         click.secho(f"Start import {self.name} ...", fg="green")
+        if resume and self.parser_obj.checkpoint:
+            self.cursor = dict(self.parser_obj.checkpoint)
+            click.secho(
+                f"Resume import from checkpoint {self.cursor} "
+                f"({self.parser_obj.checkpoint_date})",
+                fg="blue",
+            )
+        if self.bulk_load and not self.use_bulk_load():
+            click.secho(
+                "<run> build_object is redefined: rows are built and inserted "
+                "one by one (define build_objects to use the bulk loader)",
+                fg="yellow",
+            )
+            self.bulk_load = False
+        self.load_nomenclatures()
         self.start()
+        self.plan = self.compile_plan()
         self.nb_row_imported = 0
-        previous_percetage = 0
         click.secho("Fetching data from source", fg="green")
+        if (
+            self.bulk_load
+            and self.load_mode == "merge"
+            and not SyntheseLoader.has_conflict_index(self.upsert_keys)
+        ):
+            # ON CONFLICT would fail on every batch
+            click.secho(
+                f"<run> No unique index on gn_synthese.synthese "
+                f"({', '.join(self.upsert_keys)}): merge load mode is not "
+                "possible, rows are inserted (existing rows may be duplicated). "
+                "Remove the duplicates of the synthese and run "
+                "`geonature db upgrade api2gn@head` to create the index",
+                fg="red",
+                bold=True,
+            )
+            self.load_mode = "insert"
+        if self.bulk_load:
+            self.loader = SyntheseLoader(
+                batch_size=self.batch_size,
+                method=self.load_method,
+                mode=self.load_mode,
+                conflict_keys=self.upsert_keys,
+                prepare=self.prepare_batch,
+                dry_run=dry_run,
+            )
         if self.progress_bar:
             pbar = tqdm(total=100)
-        for row in self.next_row():
+        if self.bulk_load:
+            nb_row_committed = 0
+            pages = self.iter_pages()
             try:
-                obj = self.build_object(row)
-                if not obj:
-                    continue
-                self.insert(obj)
-            except Exception as e:
-                click.secho(f"<run> Build and insert object error {e}", fg="red")
-            self.nb_row_imported += 1
-            if self.progress_bar:
-                previous_percetage = (self.nb_row_imported / self.total) * 100
-                new_percentage = (self.nb_row_imported / self.total) * 100
-                to_update = new_percentage - previous_percetage
-                pbar.update(to_update)
+                for page in pages:
+                    try:
+                        synthese_dicts = self.build_objects(page)
+                    except Exception as e:
+                        click.secho(
+                            f"<run> Build page error {e}, building rows one by one",
+                            fg="red",
+                        )
+                        synthese_dicts = Parser.build_objects(self, page)
+                    self.loader.extend(synthese_dicts)
+                    self.nb_row_imported += len(synthese_dicts)
+                    if self.nb_row_imported - nb_row_committed >= self.commit_every:
+                        self.commit(dry_run)
+                        nb_row_committed = self.nb_row_imported
+                    if self.progress_bar and self.total:
+                        pbar.update(len(page) / self.total * 100)
+            finally:
+                # a failed run releases the source at once (streamed response,
+                # temporary archive...)
+                if hasattr(pages, "close"):
+                    pages.close()
+        else:
+            for row in self.next_row():
+                try:
+                    obj = self.build_object(row)
+                    if not obj:
+                        continue
+                    self.insert(obj)
+                except Exception as e:
+                    click.secho(f"<run> Build and insert object error {e}", fg="red")
+                self.nb_row_imported += 1
+                if self.progress_bar and self.total:
+                    pbar.update(1 / self.total * 100)
         if self.progress_bar:
             pbar.close()
 
@@ -159,20 +462,37 @@ class Parser(GeometryMixin, NomenclatureMixin):
             "Successfully fetch data from source. Inserting data in db now...",
             fg="green",
         )
-        if not dry_run:
-            try:
-                db.session.commit()
-            except Exception as e:
-                click.secho(f"<run> Commit changes error {e}", fg="red")
-        self.save_history()
+        self.commit(dry_run)
+        self.print_nomenclature_report()
+        if self.bulk_load:
+            self.nb_row_imported -= self.loader.nb_row_failed
+            if self.load_mode == "merge" and not dry_run:
+                click.secho(
+                    f"{self.loader.nb_row_inserted} inserted, "
+                    f"{self.loader.nb_row_updated} updated, "
+                    f"{self.loader.nb_row_unchanged} unchanged row(s)",
+                    fg="green",
+                )
+        self.save_history(dry_run)
         self.end()
+        if getattr(self, "_http", None) is not None:
+            click.secho(self.http.summary(), fg="blue")
         click.secho(f"Successfully import {self.nb_row_imported} row(s)", fg="green")
         if self.counter > self.nb_row_imported:
             click.secho(f"{self.counter-self.nb_row_imported} row(s) could not be imported", fg="red")
 
 
 class JSONParser(Parser):
+    """
+    Attributes:
+        prefetch_pages(int): when the total number of rows is known
+            (`total` property), number of page requests kept in flight while
+            the previous pages are transformed and loaded. 0 to disable
+    """
+
     limit = 100
+    bulk_load = True
+    prefetch_pages = module_config["PARSER_PREFETCH_PAGES"]
 
     def validate_maping(self):
         """
@@ -189,42 +509,92 @@ class JSONParser(Parser):
         shapely_geom = shape(row["geometry"])
         return from_shape(shapely_geom, srid=self.srid)
 
+    def get_geoms(self, rows):
+        """
+        Page level get_geom: must return a list or array of shapely geoms
+        (None when a row has no geometry)
+        """
+        return [shape(row["geometry"]) if row.get("geometry") else None for row in rows]
+
+    def build_objects(self, page):
+        """
+        Build a whole page at once: the compiled plan runs over every row and
+        the geometries of the page are converted and filled in one block.
+        Parsers redefining get_geom without get_geoms are built row by row
+        """
+        if not SHAPELY_2 or self._is_overridden_after("get_geom", "get_geoms"):
+            return super().build_objects(page)
+        if self.plan is None:
+            self.plan = self.compile_plan()
+        rows = [row for row in page if row]
+        synthese_dicts = [self.plan(row) for row in rows]
+        return self.fill_geoms(synthese_dicts, self.get_geoms(rows))
+
     def build_object(self, row):
+        synthese_dict = self.build_dict(row)
+        if not synthese_dict:
+            return None
+        return Synthese(**synthese_dict)
+
+    def compile_plan(self):
+        """
+        Compile the mapping into a closure so the per-row work is only
+        dict lookups: empty source values are skipped and nomenclature codes
+        are resolved from the preloaded cache (unknown codes are left to the
+        column default value)
+        """
+        mapping = self._split_mapping()
+        constants = dict(self.constant_fields)
+        dynamic = list(self.dynamic_fields.items())
+        additional = list(self.additionnal_fields.items())
+        plain = [
+            (gn_col, field)
+            for gn_col, field in mapping
+            if not gn_col.startswith("id_nomenclature")
+        ]
+        nomenclatures = [
+            (gn_col, field, self.nomenclature_mapping[gn_col])
+            for gn_col, field in mapping
+            if gn_col.startswith("id_nomenclature")
+        ]
+        nomenclature_ids = self.nomenclatures
+        get_id_nomenclature = self.get_id_nomenclature
+
+        def transform(row):
+            synthese_dict = dict(constants)
+            for gn_col, _func in dynamic:
+                value = _func(row)
+                if value:
+                    synthese_dict[gn_col] = value
+            if additional:
+                additional_data = dict(synthese_dict.get("additional_data") or {})
+                for add_field, json_field in additional:
+                    additional_data[add_field] = row[json_field]
+                synthese_dict["additional_data"] = additional_data
+            get = row.get
+            for gn_col, json_field in plain:
+                value = get(json_field)
+                if value:
+                    synthese_dict[gn_col] = value
+            for gn_col, json_field, mnemonique in nomenclatures:
+                value = get(json_field)
+                if value:
+                    id_nomenclature = nomenclature_ids.get(
+                        (mnemonique, str(value))
+                    ) or get_id_nomenclature(gn_col, value)
+                    if id_nomenclature:
+                        synthese_dict[gn_col] = id_nomenclature
+            return synthese_dict
+
+        return transform
+
+    def build_dict(self, row):
         if not row:
             return None
+        if self.plan is None:
+            self.plan = self.compile_plan()
 
-        synthese_dict = {}
-        for gn_col, const in self.constant_fields.items():
-            synthese_dict[gn_col] = const
-            self.mapping.pop(gn_col, None)
-        for gn_col, _func in self.dynamic_fields.items():
-            value = _func(row)
-            if value:
-                synthese_dict[gn_col] = _func(row)
-            self.mapping.pop(gn_col, None)
-        if self.additionnal_fields:
-            for add_field, json_field in self.additionnal_fields.items():
-                self.mapping.pop(add_field, None)
-                synthese_dict.setdefault("additional_data", {})[add_field] = row[
-                    json_field
-                ]
-
-        for gn_col, json_field in self.mapping.items():
-            if row.get(json_field):
-                if gn_col.startswith("id_nomenclature"):
-                    try:
-                        nomenclature_mnemonique_type = self.nomenclature_mapping[gn_col]
-                    except KeyError as e:
-                        click.secho(
-                            f"\nCannot find a nomenclature mnemonique type for `{gn_col}` - Please update the `nomenclature_mapping` class attribute",
-                            fg="red",
-                        )
-                        raise click.ClickException("Stop import")
-                    synthese_dict[gn_col] = func.ref_nomenclatures.get_id_nomenclature(
-                        nomenclature_mnemonique_type, row.get(json_field)
-                    )
-                else:
-                    synthese_dict[gn_col] = row.get(json_field)
+        synthese_dict = self.plan(row)
         wkb_geom = self.get_geom(row)
         if wkb_geom:
             synthese_dict = self.fill_dict_with_geom(synthese_dict, wkb_geom)
@@ -233,27 +603,113 @@ class JSONParser(Parser):
                 f"!!! No geom for {synthese_dict}",
                 fg="red",
             )
-        return Synthese(**synthese_dict)
+        return synthese_dict
 
-    def next_row(self, page=0):
+    def fetch_page(self, filters):
+        return self.request_or_retry(self.url, params=filters).json()
+
+    def _known_total(self):
+        try:
+            return self.total
+        except (AttributeError, KeyError, TypeError):
+            return None
+
+    def next_page(self, page=0):
+        first_page = page
+        page = self.cursor.get("page", page)
+        skip = self.cursor.get("row", 0)
         filters = {
             **self.api_filters,
             self.page_parameter: page,
             self.limit_parameter: self.limit,
         }
         while True:
-            response = self.request_or_retry(self.url, params=filters)
-            self.root = response.json()
-            for row in self.items:
-                yield row
-            if len(self.items) < self.limit:
+            self.root = self.fetch_page(filters)
+            items = self.items
+            self.cursor = {"page": filters[self.page_parameter], "row": len(items)}
+            yield items[skip:]
+            skip = 0
+            if len(items) < self.limit:
                 break
             filters[self.page_parameter] += 1
 
+            total = self._known_total() if self.prefetch_pages else None
+            if total is None:
+                continue
+            # the page count is known: fetch the next pages concurrently,
+            # they are still yielded in order
+            last_page = first_page + math.ceil(total / self.limit) - 1
+            page_numbers = range(filters[self.page_parameter], last_page + 1)
+            roots = iter_concurrent(
+                lambda page_number: self.fetch_page(
+                    {**filters, self.page_parameter: page_number}
+                ),
+                page_numbers,
+                self.prefetch_pages,
+            )
+            try:
+                for page_number, root in zip(page_numbers, roots):
+                    self.root = root
+                    items = self.items
+                    self.cursor = {"page": page_number, "row": len(items)}
+                    yield items
+                    filters[self.page_parameter] = page_number + 1
+                    if len(items) < self.limit:
+                        return
+            finally:
+                roots.close()
+            # rows added since the first page are read sequentially
+
+    def next_row(self):
+        for page in self.next_page():
+            yield from page
+
 
 class WFSParser(Parser):
+    """
+    Attributes:
+        layer(str): name of the WFS feature type
+        wfs_version(str): WFS version of the GetFeature requests
+        stream(bool): parse the GetFeature response while it is downloaded
+            (iterparse) instead of loading the whole document, memory stays
+            bounded by the batch size whatever the layer size
+        page_size(int): WFS 2.0 only, fetch the layer by pages of
+            `page_size` features (startIndex / count) instead of a single
+            GetFeature request
+        prefetch_pages(int): number of pages fetched concurrently when the
+            server gives the number of features (resultType=hits)
+        sort_by(str): SORTBY parameter, some servers need a sort order to
+            return stable pages
+        prefer_geojson(bool): ask GetFeature in GeoJSON when the server
+            advertises a JSON outputFormat in its GetCapabilities. Ignored
+            (GML is read) with `stream`, `dynamic_fields`, XML paths in the
+            mapping or when a parser redefines how the XML is read
+            (sub_items, late_filter_feature, get_xml_value, get_geom...)
+        filters(dict): declarative filters sent to the server (see
+            `api2gn.ogc_filter.parse_filters`): bbox, property values and
+            features modified since the last import
+        filter_language(str): "fes" (OGC Filter Encoding, FILTER parameter),
+            "cql" (CQL_FILTER, GeoServer) or "client" (filter the fetched
+            features). Filters the server rejects are applied client side
+    """
+
     layer: str
     wfs_version: str
+    bulk_load = True
+    stream = False
+    page_size: int = None
+    prefetch_pages = module_config["PARSER_PREFETCH_PAGES"]
+    sort_by: str = None
+    prefer_geojson = True
+    # (feature, index) of the last feature read by find_xml_tag
+    _feature_index = (None, None)
+    # negotiated GeoJSON outputFormat, "" for GML
+    _geojson_format = None
+    filters = dict()
+    filter_language = "fes"
+    # negotiated filter parameters, and conditions evaluated client side
+    _filter_params = None
+    client_filters = ()
 
     @property
     def sub_items(self):
@@ -266,92 +722,570 @@ class WFSParser(Parser):
 
     @property
     def items(self):
+        if self.geojson_format:
+            return self.decode_features(self.root.content)
         return ET.fromstring(self.root.text)
 
+    def decode_features(self, content):
+        """
+        Features of a GeoJSON GetFeature response
+        """
+        return json_loads(content).get("features") or []
+
+    @property
+    def geojson_format(self):
+        """
+        GeoJSON outputFormat used for GetFeature, None when GML is read.
+        Negotiated once, on first use
+        """
+        if self._geojson_format is None:
+            self._geojson_format = self.negotiate_geojson_format() or ""
+        return self._geojson_format or None
+
+    def negotiate_geojson_format(self):
+        if not self.prefer_geojson or self.stream or self.dynamic_fields:
+            return None
+        xml_hooks = (
+            "sub_items",
+            "late_filter_feature",
+            "find_xml_tag",
+            "get_xml_value",
+            "get_geometry_tag",
+            "get_geom",
+            "get_geoms",
+            "build_dict",
+        )
+        if any(self._is_overridden_after(hook, "geojson_format") for hook in xml_hooks):
+            return None
+        fields = [*self.mapping.values(), *self.additionnal_fields.values()]
+        if any("/" in field or "}" in field for field in fields):
+            return None
+        try:
+            formats = self.get_output_formats()
+        except (click.ClickException, requests.RequestException, ET.ParseError) as e:
+            click.secho(f"Could not read the WFS capabilities, using GML : {e}", fg="yellow")
+            return None
+        json_formats = [f for f in formats if "json" in f.lower()]
+        for preferred in ("application/json", "application/geo+json"):
+            if preferred in json_formats:
+                json_formats.remove(preferred)
+                json_formats.insert(0, preferred)
+        if not json_formats or not self.check_geojson_srid(json_formats[0]):
+            return None
+        return json_formats[0]
+
+    def check_geojson_srid(self, output_format):
+        """
+        Ask a single feature in GeoJSON and check it comes in `srid`: some
+        servers ignore srsName or answer in EPSG:4326 (RFC 7946)
+        """
+        params = {
+            "version": self.wfs_version,
+            "request": "GetFeature",
+            "TYPENAME": self.layer,
+            "service": "WFS",
+            "outputFormat": output_format,
+            "srsName": f"EPSG:{self.srid}",
+            "count" if self.is_wfs_2 else "maxFeatures": 1,
+        }
+        try:
+            response = self.request_or_retry(self.url, params=params)
+            srid = geojson_srid(json_loads(response.content))
+        except (click.ClickException, requests.RequestException, ValueError) as e:
+            click.secho(f"Could not read a GeoJSON feature, using GML : {e}", fg="yellow")
+            return False
+        if srid != self.srid:
+            click.secho(
+                f"The WFS server answers GeoJSON in EPSG:{srid} instead of "
+                f"EPSG:{self.srid}, using GML",
+                fg="yellow",
+            )
+            return False
+        return True
+
+    def get_output_formats(self):
+        """
+        GetFeature output formats listed in the GetCapabilities document
+        """
+        response = self.request_or_retry(
+            self.url,
+            params={
+                "service": "WFS",
+                "version": self.wfs_version,
+                "request": "GetCapabilities",
+            },
+        )
+        capabilities = ET.fromstring(response.content)
+        formats = []
+        # WFS 1.1 / 2.0 : ows:Operation/ows:Parameter[@name=outputFormat]
+        for operation in capabilities.iter("{*}Operation"):
+            if operation.get("name") != "GetFeature":
+                continue
+            for parameter in operation.iter("{*}Parameter"):
+                if parameter.get("name") == "outputFormat":
+                    formats += [v.text for v in parameter.iter("{*}Value") if v.text]
+        # WFS 1.0 : GetFeature/ResultFormat/<FORMAT/>
+        for result_format in capabilities.iter("{*}ResultFormat"):
+            formats += [child.tag.rpartition("}")[2] for child in result_format]
+        return formats
+
+    def index_feature(self, feature):
+        """
+        Walk a feature once and return a dict: tag local name -> first
+        descendant element with this name (in document order, as
+        `feature.find(".//{*}" + name)`)
+        """
+        index = {}
+        elements = feature.iter()
+        next(elements)  # the feature itself
+        for elem in elements:
+            tag = elem.tag
+            localname = _LOCALNAMES.get(tag)
+            if localname is None:
+                if not isinstance(tag, str):
+                    # comments, processing instructions
+                    continue
+                localname = _LOCALNAMES[tag] = tag.rpartition("}")[2]
+            if localname not in index:
+                index[localname] = elem
+        return index
+
+    def find_xml_tag(self, parent_tag, xml_key):
+        """
+        Return the first descendant of parent_tag named xml_key (whatever
+        its namespace). The index of the last feature is kept, so all the
+        fields of a feature are read with a single walk of its tree
+        """
+        if "}" in xml_key:
+            # qualified name
+            return parent_tag.find(".//" + xml_key)
+        if "/" in xml_key:
+            return parent_tag.find(".//{*}" + xml_key)
+        if self._feature_index[0] is not parent_tag:
+            self._feature_index = (parent_tag, self.index_feature(parent_tag))
+        return self._feature_index[1].get(xml_key)
+
     def get_xml_value(self, parent_tag, xml_key):
-        new_tag = parent_tag.find(".//{*}" + xml_key)
+        new_tag = self.find_xml_tag(parent_tag, xml_key)
         if new_tag is None:
             return None
         else:
             return new_tag.text
 
-    def get_geom(self, xml_feature):
+    def get_geometry_tag(self, xml_feature):
+        """
+        Return the GML geometry element of a feature (None if not found)
+        """
         # the tag containing the gml
-        geometry_parent_tag = xml_feature.find(
-            ".//{*}" + self.mapping[self.geometry_col]
+        geometry_parent_tag = self.find_xml_tag(
+            xml_feature, self.mapping[self.geometry_col]
         )
-        if geometry_parent_tag:
-            geometry_tag = None
-            for geometry_type in ("Point", "LineString", "Polygon"):
-                geometry_tag = geometry_parent_tag.find(".//{*}" + geometry_type)
-                if geometry_tag:
-                    break
-            if geometry_tag is not None:
-                geom = pygml.parse(
-                    ET.tostring(geometry_tag, encoding="unicode", method="xml")
-                )
-                shapely_geom = shape(geom.geometry)
-                return from_shape(shapely_geom, srid=self.srid)
-            else:
-                print("Geometry tag not found for this feature")
+        if geometry_parent_tag is None:
+            print(
+                f"Tag containning geometry ({self.mapping[self.geometry_col]}) not found"
+            )
+            return None
+        geometry_tag = find_gml_geometry(geometry_parent_tag)
+        if geometry_tag is None:
+            print("Geometry tag not found for this feature")
+        return geometry_tag
+
+    def get_geom(self, xml_feature):
+        if self.geojson_format:
+            if not xml_feature.get("geometry"):
                 return None
-        print(f"Tag containning geometry ({self.mapping[self.geometry_col]}) not found")
-        return None
+            return from_shape(shape(xml_feature["geometry"]), srid=self.srid)
+        geometry_tag = self.get_geometry_tag(xml_feature)
+        if geometry_tag is None:
+            return None
+        return from_shape(gml_to_shape(geometry_tag), srid=self.srid)
 
-    def next_row(self):
+    def get_geoms(self, features):
         """
-        The WFS parser do not implement pagination as WFS is a mess !!
-        It fetch all the stream at once. Maybe won't work for big data quantity
+        Page level get_geom: the GML geometries of the page are decoded
+        in one block
         """
+        if self.geojson_format:
+            return [
+                shape(feature["geometry"]) if feature.get("geometry") else None
+                for feature in features
+            ]
+        return decode_gml([self.get_geometry_tag(feature) for feature in features])
 
-        count_or_max_feature = (
-            "count" if self.wfs_version in ("2.0.0", "2.0.1") else "maxFeatures"
-        )
+    @property
+    def is_wfs_2(self):
+        return self.wfs_version in ("2.0.0", "2.0.1")
+
+    def get_feature_params(self, filtered=True):
         api_filters = {
             "version": self.wfs_version,
             "request": "GetFeature",
             "TYPENAME": self.layer,
             "service": "WFS",
         }
+        if self.sort_by:
+            api_filters["SORTBY"] = self.sort_by
+        if self.geojson_format:
+            api_filters["outputFormat"] = self.geojson_format
+            # x / y coordinates in the SRID of the parser
+            api_filters["srsName"] = f"EPSG:{self.srid}"
+        if filtered:
+            api_filters.update(self.filter_params)
+        return api_filters
+
+    @property
+    def filter_params(self):
+        """
+        GetFeature parameters evaluating `filters` on the server.
+        Negotiated once, on first use
+        """
+        if self._filter_params is None:
+            self._filter_params = self.negotiate_filter_params()
+        return self._filter_params
+
+    def negotiate_filter_params(self):
+        try:
+            conditions = ogc_filter.parse_filters(
+                self.filters,
+                self.mapping.get(self.geometry_col),
+                self.srid,
+                self.parser_obj.last_import,
+            )
+        except ValueError as e:
+            raise click.ClickException(f"Invalid WFS filters of {self.name}: {e}")
+        self.client_filters = []
+        if not conditions:
+            return {}
+        if self.filter_language != "client":
+            if self.filter_language == "cql":
+                params = {"CQL_FILTER": ogc_filter.to_cql(conditions)}
+            else:
+                params = {"FILTER": ogc_filter.to_fes(conditions, self.wfs_version)}
+            if self.probe_filter(params):
+                return params
+            click.secho(
+                "The WFS server cannot evaluate the filters, "
+                "they are applied to the fetched features",
+                fg="yellow",
+            )
+        self.client_filters = conditions
+        return {}
+
+    def probe_filter(self, params):
+        """
+        Ask a single feature with the filter parameters, return False if
+        the server rejects them
+        """
+        probe = {
+            **self.get_feature_params(filtered=False),
+            **params,
+            "count" if self.is_wfs_2 else "maxFeatures": 1,
+        }
+        try:
+            response = self.request_or_retry(self.url, params=probe)
+        except click.ClickException:
+            return False
+        # most servers answer an OGC exception with a 200 status
+        return b"ExceptionReport" not in response.content[:2000]
+
+    def match_client_filters(self, feature):
+        """
+        Evaluate the property filters the server could not evaluate
+        """
+        if not self.client_filters:
+            return True
+        if self.geojson_format:
+            get_value = (feature.get("properties") or {}).get
+        else:
+            get_value = lambda key: self.get_xml_value(feature, key)
+        return ogc_filter.match(self.client_filters, get_value)
+
+    @property
+    def client_bbox(self):
+        """
+        Bbox filter (shapely polygon) evaluated client side, None if there is none
+        """
+        for _prop, operator, value in self.client_filters:
+            if operator == "bbox":
+                return box(*value[:4])
+        return None
+
+    def next_row(self):
+        """
+        WFS pagination is a mess !! Without `page_size` (or before WFS 2.0)
+        the parser fetch all the stream at once. For big layers set
+        `stream = True` and / or `page_size`
+        """
+        if self.page_size and self.is_wfs_2:
+            yield from self.next_paged_row()
+            return
+
+        is_wfs_2 = self.is_wfs_2
+        count_or_max_feature = "count" if is_wfs_2 else "maxFeatures"
+        api_filters = self.get_feature_params()
+        start_index = self.cursor.get("startIndex", 0)
+        # WFS 2.0 can start at an index, older versions are skipped locally
+        skip = 0
+        if start_index and is_wfs_2:
+            api_filters["startIndex"] = start_index
+        else:
+            skip = start_index
         if self.limit:
-            api_filters[count_or_max_feature] = self.limit
-        self.root = self.request_or_retry(self.url, params=api_filters)
-        for xml_node in self.items:
-            yield xml_node
+            api_filters[count_or_max_feature] = self.limit - (start_index - skip)
+        if self.stream:
+            response = self.request_or_retry(
+                self.url, params=api_filters, stream=True
+            )
+            members = self.iter_members(response)
+        else:
+            self.root = self.request_or_retry(self.url, params=api_filters)
+            members = self.items
+        try:
+            for i, xml_node in enumerate(members):
+                if i < skip:
+                    continue
+                self.cursor = {"startIndex": start_index - skip + i + 1}
+                yield xml_node
+        finally:
+            if self.stream:
+                response.close()
+
+    def fetch_hits(self):
+        """
+        Number of features of the layer (WFS 2.0 resultType=hits),
+        None if the server does not know it
+        """
+        params = {**self.get_feature_params(), "resultType": "hits"}
+        # the hits document is read in XML
+        params.pop("outputFormat", None)
+        response = self.request_or_retry(self.url, params=params)
+        try:
+            return int(ET.fromstring(response.content).get("numberMatched"))
+        except (ET.ParseError, TypeError, ValueError):
+            return None
+
+    def fetch_page(self, start_index, count):
+        """
+        Return the feature members of a GetFeature page
+        """
+        response = self.request_or_retry(
+            self.url,
+            params={
+                **self.get_feature_params(),
+                "startIndex": start_index,
+                "count": count,
+            },
+            stream=not self.geojson_format,
+        )
+        if self.geojson_format:
+            return self.decode_features(response.content)
+        try:
+            return list(self.iter_members(response))
+        finally:
+            response.close()
+
+    def fetch_full_page(self, start_index, count):
+        """
+        Return the `count` feature members from `start_index`: a server
+        capping the number of features per request answers a short page,
+        the missing members are fetched after the ones received
+        """
+        members = self.fetch_page(start_index, count)
+        while len(members) < count:
+            more = self.fetch_page(start_index + len(members), count - len(members))
+            if not more:
+                raise click.ClickException(
+                    f"The WFS server returned {len(members)} of the {count} "
+                    f"features expected from startIndex {start_index}: the "
+                    "layer changed during the import, run it again"
+                )
+            members.extend(more)
+        return members
+
+    def next_paged_row(self):
+        """
+        Fetch the layer by pages of `page_size` features.
+        When the number of features is known, `prefetch_pages` pages are
+        downloaded concurrently and yielded in order, else the pages are
+        read one after the other until the server returns no feature
+        """
+        start_index = self.cursor.get("startIndex", 0)
+        total = self.fetch_hits()
+        if self.limit:
+            total = self.limit if total is None else min(total, self.limit)
+
+        if total is not None:
+            starts = range(start_index, total, self.page_size)
+            pages = iter_concurrent(
+                lambda start: self.fetch_full_page(
+                    start, min(self.page_size, total - start)
+                ),
+                starts,
+                max(self.prefetch_pages, 1),
+            )
+            try:
+                for start, members in zip(starts, pages):
+                    for i, xml_node in enumerate(members):
+                        self.cursor = {"startIndex": start + i + 1}
+                        yield xml_node
+            finally:
+                pages.close()
+            return
+
+        start = start_index
+        while True:
+            members = self.fetch_page(start, self.page_size)
+            if not members:
+                break
+            for i, xml_node in enumerate(members):
+                self.cursor = {"startIndex": start + i + 1}
+                yield xml_node
+            # a page shorter than page_size may come from a server cap
+            start += len(members)
+
+    def iter_members(self, response):
+        """
+        Yield the feature members of a streamed GetFeature response as soon
+        as they are parsed.
+        Each member is detached from the document when yielded: once the
+        caller drops it (i.e. once its batch is loaded) it is freed, so the
+        parsed tree never grows with the layer size.
+        Members grouped in a `featureMembers` element (WFS 1.1) are yielded
+        one by one, `boundedBy` is skipped.
+        """
+        # transparently decompress gzip / deflate bodies
+        response.raw.decode_content = True
+        stack = []
+        for event, elem in ET.iterparse(response.raw, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            if not stack:
+                break
+            parent = stack[-1]
+            in_collection = len(stack) == 1
+            in_members = (
+                len(stack) == 2 and parent.tag.rpartition("}")[2] == "featureMembers"
+            )
+            if not (in_collection or in_members):
+                continue
+            parent.remove(elem)
+            if elem.tag.rpartition("}")[2] in ("boundedBy", "featureMembers"):
+                continue
+            yield elem
 
     def late_filter_feature(self, feature):
         """
         In WFS filters are hard to implement, but with this fonction you can
         implement "late filters". The API will fetch all data, but only the features
-        match the filter will be return by the build_objects func
+        match the filter will be return by the build_objects func.
+        Prefer the declarative `filters`, evaluated by the server
         """
         return True
 
     def build_object(self, row):
+        synthese_dict_value = self.build_dict(row)
+        if not synthese_dict_value:
+            return None
+        return Synthese(**synthese_dict_value)
+
+    def build_objects(self, page):
+        """
+        Build a whole page at once: filtered features go through the compiled
+        plan and their geometries are decoded in one block (`get_geoms`).
+        Parsers redefining get_geom or build_dict are built feature by feature
+        """
+        if (
+            not SHAPELY_2
+            or self._is_overridden_after("get_geom", "get_geoms")
+            or self._is_overridden_after("build_dict", "get_geoms")
+        ):
+            return super().build_objects(page)
+        if self.plan is None:
+            self.plan = self.compile_plan()
+        features = []
+        for row in page:
+            self.row_root = row
+            feature = self.sub_items
+            if self.late_filter_feature(feature) and self.match_client_filters(
+                feature
+            ):
+                features.append(feature)
+        geoms = self.get_geoms(features)
+        bbox = self.client_bbox
+        if bbox is not None:
+            geoms = np.asarray(geoms, dtype=object)
+            inside = shapely.intersects(geoms, bbox)
+            features = [feature for feature, keep in zip(features, inside) if keep]
+            geoms = geoms[inside]
+        synthese_dicts = [self.plan(feature) for feature in features]
+        return self.fill_geoms(synthese_dicts, geoms)
+
+    def compile_plan(self):
+        """
+        Compile the mapping into a closure reading the XML values of a feature
+        (or the properties of a GeoJSON feature)
+        """
+        if self.geojson_format:
+            return self.compile_geojson_plan()
+        mapping = self._split_mapping()
+        constants = dict(self.constant_fields)
+        dynamic = list(self.dynamic_fields.items())
+        additional = list(self.additionnal_fields.items())
+        get_xml_value = self.get_xml_value
+
+        def transform(feature):
+            synthese_dict = dict(constants)
+            for gn_col, _func in dynamic:
+                synthese_dict[gn_col] = _func(feature)
+            if additional:
+                additional_data = dict(synthese_dict.get("additional_data") or {})
+                for add_field, xml_key in additional:
+                    additional_data[add_field] = get_xml_value(feature, xml_key)
+                synthese_dict["additional_data"] = additional_data
+            for gn_col, xml_key in mapping:
+                synthese_dict[gn_col] = get_xml_value(feature, xml_key)
+            return synthese_dict
+
+        return transform
+
+    def compile_geojson_plan(self):
+        mapping = self._split_mapping()
+        constants = dict(self.constant_fields)
+        additional = list(self.additionnal_fields.items())
+
+        def transform(feature):
+            properties = feature.get("properties") or {}
+            synthese_dict = dict(constants)
+            if additional:
+                additional_data = dict(synthese_dict.get("additional_data") or {})
+                for add_field, key in additional:
+                    additional_data[add_field] = properties.get(key)
+                synthese_dict["additional_data"] = additional_data
+            for gn_col, key in mapping:
+                synthese_dict[gn_col] = properties.get(key)
+            return synthese_dict
+
+        return transform
+
+    def build_dict(self, row):
         self.row_root = row
-        synthese_dict_value = {}
         if not self.late_filter_feature(self.sub_items):
             return
-        for gn_col, const_value in self.constant_fields.items():
-            self.mapping.pop(gn_col, None)
-            synthese_dict_value[gn_col] = const_value
-        for gn_col, _func in self.dynamic_fields.items():
-            self.mapping.pop(gn_col, None)
-            synthese_dict_value[gn_col] = _func(self.sub_items)
-        if self.additionnal_fields:
-            for add_field, xml_key in self.additionnal_fields.items():
-                self.mapping.pop(add_field, None)
-                synthese_dict_value.setdefault("additional_data", {})[add_field] = (
-                    self.get_xml_value(self.sub_items, xml_key)
-                )
-        for gn_col, xml_key in self.mapping.items():
-            val = self.get_xml_value(self.sub_items, xml_key)
-            synthese_dict_value[gn_col] = val
+        if not self.match_client_filters(self.sub_items):
+            return
+        if self.plan is None:
+            self.plan = self.compile_plan()
         # geom
         wkb_geom = self.get_geom(self.sub_items)
+        bbox = self.client_bbox
+        if bbox is not None and not (wkb_geom and to_shape(wkb_geom).intersects(bbox)):
+            return
+        synthese_dict_value = self.plan(self.sub_items)
         if wkb_geom:
             synthese_dict_value = self.fill_dict_with_geom(
                 synthese_dict_value, wkb_geom
             )
 
-        return Synthese(**synthese_dict_value)
+        return synthese_dict_value
@@ -3,19 +3,23 @@
 
 import json
 import re
+from time import monotonic
 from typing import Dict, Any, List, Optional
 
 import click
 import requests
 from shapely.geometry import Point
 from geoalchemy2.shape import from_shape
-from sqlalchemy import select, text
+from sqlalchemy import Text, any_, bindparam, func, select, text
+from sqlalchemy.dialects.postgresql import ARRAY
 
 from geonature.utils.env import db
 from geonature.utils.config import config as gn_config
 from geonature.core.gn_meta.models import TDatasets, TAcquisitionFramework
 
 from api2gn.parsers import JSONParser
+from api2gn.taxref import CdNomCache
+from api2gn.utils import iter_concurrent
 
 
 
@@ -35,6 +39,8 @@ DEFAULT_CONFIG = {
     "plantnet_geometry_type": "Polygon",
     "plantnet_geometry_coordinates_json": None,
     "plantnet_mapping_json": "{}",
+    "plantnet_taxref_ld_workers": 8,
+    "plantnet_taxref_ld_budget": 600,
 }
 
 
@@ -48,7 +54,8 @@ try:
 except ImportError:
     Taxref = None
 
-_CD_NOM_CACHE: Dict[str, Optional[int]] = {}
+# cache persistant (api2gn.cd_nom_cache), rechargé au début de chaque import
+_CD_NOM_CACHE: Dict[str, Optional[int]] = CdNomCache()
 
 
 def normalize_scientific_name(name: str) -> str:
@@ -60,31 +67,71 @@ def normalize_scientific_name(name: str) -> str:
 
 
 def resolve_cd_nom_local(name: str) -> Optional[int]:
+    return resolve_cd_noms_local([name]).get(name)
+
+
+def resolve_cd_noms_local(names: List[str]) -> Dict[str, int]:
+    """
+    Résolution locale d'un lot de noms scientifiques en une seule requête
+    (lower(lb_nom) = ANY(...) sur les noms normalisés). Si plusieurs taxons
+    portent le même lb_nom, le nom valide (cd_nom = cd_ref) est préféré.
+    Retourne {nom: cd_nom} pour les noms trouvés uniquement
+    """
     if Taxref is None:
-        return None
+        return {}
+    cleans = {}
+    for name in names:
+        if name:
+            cleans.setdefault(normalize_scientific_name(name).lower(), []).append(name)
+    if not cleans:
+        return {}
     try:
-        clean = normalize_scientific_name(name)
-        return db.session.scalar(
-            select(Taxref.cd_nom).where(Taxref.lb_nom.ilike(clean))
-        )
+        rows = db.session.execute(
+            select(func.lower(Taxref.lb_nom), Taxref.cd_nom)
+            .where(
+                func.lower(Taxref.lb_nom)
+                == any_(bindparam("lb_noms", list(cleans), type_=ARRAY(Text)))
+            )
+            # noms valides en premier
+            .order_by(Taxref.cd_nom != Taxref.cd_ref, Taxref.cd_nom)
+        ).all()
     except Exception as e:
         click.secho(f"[TAXREF local] Erreur : {e}", fg="red")
-        return None
+        return {}
+    found = {}
+    for lb_nom, cd_nom in rows:
+        found.setdefault(lb_nom, cd_nom)
+    return {
+        name: found[clean]
+        for clean, same_names in cleans.items()
+        if clean in found
+        for name in same_names
+    }
+
 
+def fetch_cd_nom_taxref_ld(name: str, session=None) -> Optional[int]:
+    """
+    cd_nom proposé par TAXREF-LD, None si le nom est inconnu. Lève
+    requests.RequestException / ValueError si l'API n'a pas répondu
+    """
+    r = (session or requests).get(
+        "https://taxref.mnhn.fr/api/taxa",
+        params={"q": name},
+        timeout=4
+    )
+    if r.status_code == 429 or r.status_code >= 500:
+        r.raise_for_status()
+    data = r.json()
+    if isinstance(data, list) and len(data):
+        return data[0].get("cd_nom")
+    return None
 
-def resolve_cd_nom_taxref_ld(name: str) -> Optional[int]:
+
+def resolve_cd_nom_taxref_ld(name: str, session=None) -> Optional[int]:
     try:
-        r = requests.get(
-            "https://taxref.mnhn.fr/api/taxa",
-            params={"q": name},
-            timeout=4
-        )
-        data = r.json()
-        if isinstance(data, list) and len(data):
-            return data[0].get("cd_nom")
+        return fetch_cd_nom_taxref_ld(name, session=session)
     except Exception:
-        pass
-    return None
+        return None
 
 
 
@@ -173,6 +220,7 @@ class PlantNetParser(JSONParser):
         self.rejected_no_cd_nom = 0
         self.taxref_local_ok = 0
         self.taxref_ld_ok = 0
+        self.rejected_deferred = 0
 
 
         self.root = None
@@ -190,6 +238,15 @@ class PlantNetParser(JSONParser):
         self.max_data = int(cfg["plantnet_max_data"])
         self.taxref_mode = cfg["plantnet_taxref_mode"]
 
+        # TAXREF-LD : appels simultanés et durée max cumulée par import (s)
+        self.taxref_ld_workers = int(cfg["plantnet_taxref_ld_workers"])
+        self.taxref_ld_budget = int(cfg["plantnet_taxref_ld_budget"])
+        self.taxref_ld_deadline = None
+        # noms sans réponse de TAXREF-LD et, en mode strict, lignes
+        # correspondantes mises de côté : [(curseur de leur page, ligne)]
+        self.deferred_names = set()
+        self.deferred_rows = []
+
         self.empty_species = cfg["plantnet_empty_species_list"]
         self.scientific_names = [] if self.empty_species else cfg["list_species"]
 
@@ -331,17 +388,14 @@ class PlantNetParser(JSONParser):
             fg="cyan"
         )
 
-        resp = requests.post(
+        resp = self.request_or_retry(
             self.url,
+            method="POST",
             params={"api-key": self.API_KEY},
             json=self._build_payload(),
             timeout=(10, 90)
         )
 
-        if resp.status_code != 200:
-            click.secho(resp.text, fg="red")
-            raise click.ClickException("Erreur API PlantNet")
-
         data = resp.json()
         if self.root is None:
             self.root = data
@@ -368,6 +422,13 @@ class PlantNetParser(JSONParser):
             fg="green"
         )
 
+        if self.rejected_deferred:
+            click.secho(
+                f"✖ Occurrences rejetées (TAXREF-LD sans réponse) : "
+                f"{self.rejected_deferred} ({len(self.deferred_names)} taxons)",
+                fg="red"
+            )
+
 
     def print_initial_summary(self):
         click.secho("\n[PlantNet] Paramètres effectifs :", fg="cyan", bold=True)
@@ -414,47 +475,198 @@ class PlantNetParser(JSONParser):
         if lat is None or lon is None:
             return None
         return from_shape(Point(lon, lat), srid=self.srid)
+
+    def get_geoms(self, rows):
+        # points de toute la page construits en une fois (shapely 2)
+        return self.points_from_xy(
+            [row.get("decimalLongitude") for row in rows],
+            [row.get("decimalLatitude") for row in rows],
+        )
     
 
+    def start(self):
+        # noms déjà résolus lors des imports précédents
+        _CD_NOM_CACHE.warm()
+        if self.taxref_ld_budget:
+            self.taxref_ld_deadline = monotonic() + self.taxref_ld_budget
+
     def _resolve_cd_nom(self, row):
         sci = row.get("scientificName")
         if not sci:
             return None
-
-        # Cache
-        if sci in _CD_NOM_CACHE:
-            return _CD_NOM_CACHE[sci]
+        if sci not in _CD_NOM_CACHE:
+            self._resolve_cd_noms([row])
+        return _CD_NOM_CACHE.get(sci)
+
+    def _resolve_cd_noms(self, rows):
+        """
+        Résout les noms scientifiques distincts d'une page absents du cache :
+        une requête TAXREF locale pour tout le lot, puis TAXREF-LD pour les
+        seuls noms restants (cd_nom renvoyés vérifiés en une requête)
+        """
+        names = list(dict.fromkeys(
+            row["scientificName"]
+            for row in rows
+            if row.get("scientificName")
+            and row["scientificName"] not in _CD_NOM_CACHE
+            and row["scientificName"] not in self.deferred_names
+        ))
+        if not names:
+            return
 
         # 1) TAXREF local
-        cd = resolve_cd_nom_local(sci)
-        if cd:
-            _CD_NOM_CACHE[sci] = cd
-            self.taxref_local_ok += 1
-            return cd
-
-        # ⬇️ LOG ICI (et seulement ici)
-        click.secho(
-            f"[PlantNet][TAXREF] Aucun TAXREF local → fallback LD : {sci}",
-            fg="yellow"
-        )
+        local = resolve_cd_noms_local(names)
+        resolved = dict(local)
+        self.taxref_local_ok += len(local)
 
         # 2) TAXREF-LD
-        cd_ld = resolve_cd_nom_taxref_ld(sci)
-        if cd_ld:
-            exists = db.session.scalar(
-                select(Taxref.cd_nom).where(Taxref.cd_nom == cd_ld)
+        misses = [name for name in names if name not in local]
+        for sci in misses:
+            # ⬇️ LOG ICI (et seulement ici)
+            click.secho(
+                f"[PlantNet][TAXREF] Aucun TAXREF local → fallback LD : {sci}",
+                fg="yellow"
             )
-            if exists:
-                _CD_NOM_CACHE[sci] = cd_ld
-                self.taxref_ld_ok += 1
-                return cd_ld
-
-        _CD_NOM_CACHE[sci] = None
-        return None
-
+        resolved.update(self._resolve_taxref_ld(misses))
+        _CD_NOM_CACHE.store(resolved)
 
+    def _fetch_taxref_ld(self, name):
+        if self.taxref_ld_deadline and monotonic() > self.taxref_ld_deadline:
+            return name, False, None
+        try:
+            return name, True, fetch_cd_nom_taxref_ld(name, session=self.http)
+        except (requests.RequestException, ValueError):
+            return name, False, None
+
+    def _resolve_taxref_ld(self, names):
+        """
+        Interroge TAXREF-LD pour les noms en parallèle (taxref_ld_workers
+        appels simultanés sur le pool de connexions du parser) et retourne
+        {nom: cd_nom ou None}. Les noms sans réponse (erreur, délai, budget
+        taxref_ld_budget épuisé) sont placés dans deferred_names
+        """
+        cd_lds = {}
+        for sci, answered, cd_ld in iter_concurrent(
+            self._fetch_taxref_ld, names, max(self.taxref_ld_workers, 1)
+        ):
+            if answered:
+                cd_lds[sci] = cd_ld
+            else:
+                self.deferred_names.add(sci)
+
+        existing = set()
+        if Taxref is not None and any(cd_lds.values()):
+            existing = set(db.session.scalars(
+                select(Taxref.cd_nom).where(
+                    Taxref.cd_nom.in_([cd for cd in cd_lds.values() if cd])
+                )
+            ))
+        resolved = {}
+        for sci, cd_ld in cd_lds.items():
+            if cd_ld in existing:
+                resolved[sci] = cd_ld
+                self.taxref_ld_ok += 1
+            else:
+                resolved[sci] = None
+        return resolved
+
+    def _retry_deferred(self):
+        """
+        Nouvel essai TAXREF-LD, dans le budget restant, pour les noms des
+        lignes mises de côté. Retourne les lignes dont le nom a obtenu une
+        réponse (rejetées si aucun cd_nom en mode strict), les autres restent
+        en attente
+        """
+        names = sorted({row["scientificName"] for _cursor, row in self.deferred_rows})
+        self.deferred_names.difference_update(names)
+        click.secho(
+            f"[PlantNet][TAXREF] Nouvel essai TAXREF-LD pour {len(names)} taxon(s) en attente",
+            fg="yellow"
+        )
+        _CD_NOM_CACHE.store(self._resolve_taxref_ld(names))
+
+        released, pending = [], []
+        for cursor, row in self.deferred_rows:
+            sci = row["scientificName"]
+            if sci in self.deferred_names:
+                pending.append((cursor, row))
+                continue
+            cd_nom = _CD_NOM_CACHE.get(sci)
+            if cd_nom is None:
+                self.rejected_rows += 1
+                self.rejected_no_cd_nom += 1
+                continue
+            row["cd_nom"] = cd_nom
+            self.imported_rows += 1
+            released.append(row)
+        self.deferred_rows = pending
+        return released
+
+    def _reject_deferred(self):
+        """
+        Fin d'import : les lignes dont le nom n'a jamais eu de réponse de
+        TAXREF-LD sont rejetées (nom non mis en cache négatif)
+        """
+        self.rejected_rows += len(self.deferred_rows)
+        self.rejected_deferred += len(self.deferred_rows)
+        self.deferred_rows = []
+
+    def _restore_deferred(self, keys):
+        """
+        Reprise (--resume) : relit les pages des lignes en attente
+        enregistrées dans le point de reprise ({"offset", "id"}) et les remet
+        en attente, les autres lignes de ces pages sont déjà écrites
+        """
+        ids_by_offset = {}
+        for key in keys:
+            ids_by_offset.setdefault(key["offset"], set()).add(key["id"])
+        resume_offset = self.offset
+        for offset, ids in sorted(ids_by_offset.items()):
+            self.offset = offset
+            for rec in self._call_api():
+                row = self._build_row(rec)
+                if row["id"] not in ids:
+                    continue
+                ids.discard(row["id"])
+                self.deferred_rows.append(({"offset": offset, "id": row["id"]}, row))
+            if ids:
+                click.secho(
+                    f"[PlantNet] {len(ids)} ligne(s) en attente introuvable(s) "
+                    f"à l'offset {offset}",
+                    fg="red"
+                )
+                self.rejected_rows += len(ids)
+                self.rejected_deferred += len(ids)
+        self.offset = resume_offset
+
+
+
+    def _build_row(self, rec):
+        media = rec.get("media") or []
+        url = media[0].get("medium_url") if media else None
+
+        bor_raw = (rec.get("basisOfRecord") or "").strip()
+        bor_norm = BASIS_OF_RECORD_MAP.get(bor_raw.lower(), bor_raw)
+
+        return {
+            "id": rec.get("id"),
+            "scientificName": rec.get("scientificName"),
+            "eventDate": rec.get("eventDate") or rec.get("observedOn"),
+            "decimalLatitude": rec.get("decimalLatitude"),
+            "decimalLongitude": rec.get("decimalLongitude"),
+            "rightsHolder": rec.get("rightsHolder"),
+            "user_id": (rec.get("user") or {}).get("id"),
+            "associatedMedia": url,
+            "basisOfRecord_norm": bor_norm,
+        }
 
-    def next_row(self):
+    def next_page(self):
+        # reprise depuis le dernier checkpoint commité (--resume)
+        self.offset = self.cursor.get("offset", self.offset)
+        skip = self.cursor.get("row", 0)
+        if self.cursor.get("deferred"):
+            self._restore_deferred(self.cursor["deferred"])
+        end_cursor = {"offset": self.offset, "row": skip}
         try:
             while True:
                 results = self._call_api()
@@ -463,24 +675,22 @@ class PlantNetParser(JSONParser):
                 if not results:
                     break
 
-                for rec in results:
-                    media = rec.get("media") or []
-                    url = media[0].get("medium_url") if media else None
-
-                    bor_raw = (rec.get("basisOfRecord") or "").strip()
-                    bor_norm = BASIS_OF_RECORD_MAP.get(bor_raw.lower(), bor_raw)
-
-                    row = {
-                        "id": rec.get("id"),
-                        "scientificName": rec.get("scientificName"),
-                        "eventDate": rec.get("eventDate") or rec.get("observedOn"),
-                        "decimalLatitude": rec.get("decimalLatitude"),
-                        "decimalLongitude": rec.get("decimalLongitude"),
-                        "rightsHolder": rec.get("rightsHolder"),
-                        "user_id": (rec.get("user") or {}).get("id"),
-                        "associatedMedia": url,
-                        "basisOfRecord_norm": bor_norm,
-                    }
+                # lignes des pages précédentes en attente de TAXREF-LD
+                page = self._retry_deferred() if self.deferred_rows else []
+                rows = [self._build_row(rec) for rec in results[skip:]]
+                # noms distincts de la page résolus en lot
+                self._resolve_cd_noms(rows)
+                for row in rows:
+                    # nom sans réponse de TAXREF-LD : ligne réessayée aux
+                    # pages suivantes (mode strict), sinon importée sans cd_nom
+                    if (
+                        row.get("scientificName") in self.deferred_names
+                        and self.taxref_mode == "strict"
+                    ):
+                        self.deferred_rows.append(
+                            ({"offset": self.offset, "id": row["id"]}, row)
+                        )
+                        continue
 
                     cd_nom = self._resolve_cd_nom(row)
 
@@ -497,7 +707,19 @@ class PlantNetParser(JSONParser):
 
                     row["cd_nom"] = cd_nom
                     self.imported_rows += 1
-                    yield row
+                    page.append(row)
+
+                # le point de reprise avance après la page et garde les clés
+                # des lignes en attente : --resume relit seulement ces lignes
+                # (les autres sont déjà écrites, même en mode insert)
+                end_cursor = {"offset": self.offset, "row": nb_results}
+                self.cursor = dict(end_cursor)
+                if self.deferred_rows:
+                    self.cursor["deferred"] = [
+                        key for key, _row in self.deferred_rows
+                    ]
+                yield page
+                skip = 0
 
                 # 🔁 Condition de poursuite
                 if nb_results < self.max_data:
@@ -512,6 +734,13 @@ class PlantNetParser(JSONParser):
                         bold=True
                     )
                     break
+
+            # ⏳ dernier essai pour les lignes en attente, puis rejet
+            if self.deferred_rows:
+                page = self._retry_deferred()
+                self._reject_deferred()
+                self.cursor = end_cursor
+                yield page
         finally:
             self.print_summary()
 
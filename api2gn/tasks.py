@@ -34,4 +34,5 @@ def run_parsers(self):
 def run_one_parser(self, parser_name):
     Parser = get_parser(parser_name)
     if Parser:
-        Parser().run()
+        # a checkpoint only remains if the previous run was interrupted
+        Parser().run(resume=True)
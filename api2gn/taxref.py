@@ -0,0 +1,125 @@
+"""
+Name -> cd_nom cache shared by the name-based parsers (PlantNet...).
+
+Resolutions are kept in memory during the import and persisted in
+api2gn.cd_nom_cache, with the TAXREF version they were made against, so the
+next runs do not query the local Taxref or TAXREF-LD again for the same
+names. Unresolved names (cd_nom NULL) are only kept
+PARSER_CD_NOM_CACHE_NEGATIVE_TTL days, and the whole cache is dropped when
+the TAXREF version changes.
+"""
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, delete, or_, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from geonature.utils.env import db
+from geonature.utils.config import config
+
+from api2gn.models import CdNomCacheModel
+
+
+def get_taxref_version():
+    """
+    Version of the installed TAXREF (taxonomie.t_meta_taxref), None if
+    TaxHub does not provide it
+    """
+    if db.session.scalar(text("SELECT to_regclass('taxonomie.t_meta_taxref')")) is None:
+        return None
+    return db.session.scalar(
+        text(
+            """
+            SELECT concat_ws(' ', referencial_name, version)
+            FROM taxonomie.t_meta_taxref
+            ORDER BY update_date DESC NULLS LAST
+            LIMIT 1
+            """
+        )
+    )
+
+
+class CdNomCache(dict):
+    """
+    name -> cd_nom dict (None for an unresolved name) backed by
+    api2gn.cd_nom_cache
+
+    warm() loads the valid entries at the start of an import and store()
+    persists new resolutions in the current transaction: they are committed
+    with the next batch of the import, a dry run rolls them back
+    """
+
+    def __init__(self, negative_ttl=None):
+        super().__init__()
+        if negative_ttl is None:
+            negative_ttl = config["API2GN"]["PARSER_CD_NOM_CACHE_NEGATIVE_TTL"]
+        self.negative_ttl = negative_ttl
+        self.taxref_version = None
+        # resolutions are only persisted once the cache has been warmed
+        self.persistent = False
+
+    def warm(self):
+        """
+        Drop the entries of another TAXREF version and the expired
+        unresolved names, then load the others in memory
+        """
+        self.clear()
+        try:
+            with db.session.begin_nested():
+                self.taxref_version = get_taxref_version()
+                db.session.execute(
+                    delete(CdNomCacheModel).where(
+                        or_(
+                            CdNomCacheModel.taxref_version.is_distinct_from(
+                                self.taxref_version
+                            ),
+                            and_(
+                                CdNomCacheModel.cd_nom.is_(None),
+                                CdNomCacheModel.resolved_at
+                                < datetime.now() - timedelta(days=self.negative_ttl),
+                            ),
+                        )
+                    )
+                )
+                self.update(
+                    db.session.execute(
+                        select(CdNomCacheModel.name, CdNomCacheModel.cd_nom)
+                    ).all()
+                )
+        except Exception as e:
+            click.secho(f"<cd_nom cache> Persistent cache disabled: {e}", fg="red")
+            self.persistent = False
+            return
+        self.persistent = True
+        click.secho(
+            f"<cd_nom cache> {len(self)} name(s) loaded "
+            f"(TAXREF {self.taxref_version or 'unknown version'})",
+            fg="blue",
+        )
+
+    def store(self, resolved):
+        """
+        Add {name: cd_nom} resolutions to the cache
+        """
+        self.update(resolved)
+        if not resolved or not self.persistent:
+            return
+        stmt = pg_insert(CdNomCacheModel).values(
+            [
+                {"name": name, "cd_nom": cd_nom, "taxref_version": self.taxref_version}
+                for name, cd_nom in resolved.items()
+            ]
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CdNomCacheModel.name],
+            set_={
+                "cd_nom": stmt.excluded.cd_nom,
+                "taxref_version": stmt.excluded.taxref_version,
+                "resolved_at": datetime.now(),
+            },
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.execute(stmt)
+        except Exception as e:
+            click.secho(f"<cd_nom cache> Could not persist resolutions: {e}", fg="red")
@@ -0,0 +1,108 @@
+"""
+Microbenchmark of api2gn.dates against the former generate_date_range
+(regexes, strptime round-trips and dateutil)
+
+    python -m api2gn.tests.benchmark_dates
+"""
+import random
+import re
+import timeit
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+
+from api2gn.dates import parse_date_range, parse_date_ranges
+
+NB_VALUES = 100000
+PAGE_SIZE = 300
+
+
+def former_generate_date_range(partial_date):
+    # api2gn.utils.generate_date_range before api2gn.dates (YYYY-MM bug included)
+    patterns = {
+        "YYYY": r"^\d{4}$",
+        "YYYY-MM": r"^\d{4}-\d{2}$",
+        "YYYY-MM-DD": r"^\d{4}-\d{2}-\d{2}$",
+    }
+    if re.match(patterns["YYYY"], partial_date):
+        min_date = f"{partial_date}-01-01"
+        max_date = f"{partial_date}-12-31"
+    elif re.match(patterns["YYYY-MM"], partial_date):
+        min_date = f"{partial_date}-01"
+        max_date = f"{partial_date}-{(datetime.strptime(partial_date, '%Y-%m').month + 1) % 12 or 12:02d}-01"
+        max_date = (
+            datetime.strptime(max_date, "%Y-%m-%d") - timedelta(days=1)
+        ).strftime("%Y-%m-%d")
+    elif re.match(patterns["YYYY-MM-DD"], partial_date):
+        min_date = partial_date
+        max_date = partial_date
+    else:
+        try:
+            min_date = max_date = parse(partial_date).strftime("%Y-%m-%d %H:%M:%S")
+        except Exception:
+            raise ValueError(f"Invalid date format for {partial_date}")
+    return min_date, max_date
+
+
+def event_date(rng):
+    """
+    GBIF-like eventDate: dates, datetimes (with or without Z), YYYY-MM, YYYY
+    """
+    year, month, day = rng.randint(1950, 2023), rng.randint(1, 12), rng.randint(1, 28)
+    draw = rng.random()
+    if draw < 0.45:
+        return f"{year}-{month:02d}-{day:02d}"
+    if draw < 0.7:
+        return (
+            f"{year}-{month:02d}-{day:02d}"
+            f"T{rng.randint(0, 23):02d}:{rng.choice([0, 15, 30]):02d}:00"
+        )
+    if draw < 0.8:
+        return f"{year}-{month:02d}"
+    if draw < 0.9:
+        return str(year)
+    return f"{year}-{month:02d}-{day:02d}T{rng.randint(0, 23):02d}:00:00Z"
+
+
+def run_former(values):
+    for value in values:
+        try:
+            former_generate_date_range(value)
+        except ValueError:
+            pass
+
+
+def run_uncached(values):
+    for value in values:
+        parse_date_range.__wrapped__(value)
+
+
+def run_cached(values):
+    parse_date_range.cache_clear()
+    for value in values:
+        parse_date_range(value)
+
+
+def run_batch(values):
+    parse_date_range.cache_clear()
+    for i in range(0, len(values), PAGE_SIZE):
+        parse_date_ranges(values[i : i + PAGE_SIZE])
+
+
+def bench(title, values):
+    print(f"{title}: {len(values)} values, {len(set(values))} distinct")
+    for name, func in (
+        ("former generate_date_range", run_former),
+        ("parse_date_range, no cache", run_uncached),
+        ("parse_date_range", run_cached),
+        (f"parse_date_ranges, pages of {PAGE_SIZE}", run_batch),
+    ):
+        duration = min(timeit.repeat(lambda: func(values), number=1, repeat=3))
+        print(f"  {name:<36} {duration / len(values) * 1e6:6.2f} us/value")
+
+
+if __name__ == "__main__":
+    rng = random.Random(0)
+    bench("mostly distinct", [event_date(rng) for _ in range(NB_VALUES)])
+    pool = [event_date(rng) for _ in range(2000)]
+    bench("repeated", [rng.choice(pool) for _ in range(NB_VALUES)])
@@ -0,0 +1,90 @@
+import pytest
+
+from api2gn.dates import parse_date_range, parse_date_ranges
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("2020", ("2020-01-01", "2020-12-31")),
+        ("2020-02", ("2020-02-01", "2020-02-29")),
+        ("2021-02", ("2021-02-01", "2021-02-28")),
+        ("2021-11", ("2021-11-01", "2021-11-30")),
+        ("2021-12", ("2021-12-01", "2021-12-31")),
+        ("2020-05-01", ("2020-05-01", "2020-05-01")),
+        (" 2020-05-01 ", ("2020-05-01", "2020-05-01")),
+        ("2020-05-01T10:30", ("2020-05-01 10:30:00", "2020-05-01 10:30:00")),
+        ("2020-05-01T10:30:00Z", ("2020-05-01 10:30:00", "2020-05-01 10:30:00")),
+        (
+            "2020-05-01T10:30:00.123+02:00",
+            ("2020-05-01 10:30:00", "2020-05-01 10:30:00"),
+        ),
+        ("2020-05-01 10:30:00", ("2020-05-01 10:30:00", "2020-05-01 10:30:00")),
+    ],
+)
+def test_single_dates(value, expected):
+    assert parse_date_range(value) == expected
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("2020-05-01/2020-05-03", ("2020-05-01", "2020-05-03")),
+        ("2019/2020", ("2019-01-01", "2020-12-31")),
+        ("2020-05/2020-06", ("2020-05-01", "2020-06-30")),
+        ("2020-05-01/2020-06", ("2020-05-01", "2020-06-30")),
+        # abbreviated ends
+        ("2020-05-01/03", ("2020-05-01", "2020-05-03")),
+        ("2020-05-01/06-03", ("2020-05-01", "2020-06-03")),
+        ("2020-05/06", ("2020-05-01", "2020-06-30")),
+        ("2020-05-01T10:00/12:00", ("2020-05-01 10:00:00", "2020-05-01 12:00:00")),
+        ("2020-05-01T10:00Z/12:00Z", ("2020-05-01 10:00:00", "2020-05-01 12:00:00")),
+        # mixed precision
+        ("2020-05-01T10:00/2020-05-01", ("2020-05-01 10:00:00", "2020-05-01 23:59:59")),
+        ("2020-05-01T10:00/2020-05-02", ("2020-05-01 10:00:00", "2020-05-02 23:59:59")),
+        ("2020-05-01/2020-05-01T10:00", ("2020-05-01", "2020-05-01 10:00:00")),
+    ],
+)
+def test_intervals(value, expected):
+    assert parse_date_range(value) == expected
+
+
+def test_other_formats_use_dateutil():
+    assert parse_date_range("2020/05/01") == (
+        "2020-05-01 00:00:00",
+        "2020-05-01 00:00:00",
+    )
+
+
+@pytest.mark.parametrize(
+    "value",
+    [
+        "",
+        "abc",
+        "2020-13",
+        "2020-00",
+        "2021-02-29",
+        "2020-02-30",
+        "2020-05-01T25:00",
+        "2020-05-03/2020-05-01",
+        "2020-05-01T12:00/10:00",
+        "2020-05-02/2020-05-01T10:00",
+    ],
+)
+def test_invalid_dates(value):
+    with pytest.raises(ValueError):
+        parse_date_range(value)
+
+
+def test_batch_reads_each_value_once():
+    parse_date_range.cache_clear()
+    ranges, errors = parse_date_ranges(
+        ["2020", "2020", None, "2020-02-30", "2020-05-01/03"]
+    )
+    assert ranges == {
+        "2020": ("2020-01-01", "2020-12-31"),
+        "2020-02-30": None,
+        "2020-05-01/03": ("2020-05-01", "2020-05-03"),
+    }
+    assert list(errors) == ["2020-02-30"]
+    assert parse_date_range.cache_info().misses == 3
@@ -0,0 +1,100 @@
+from datetime import date
+
+import pytest
+
+# the GBIF parser imports the GeoNature app and models
+pytest.importorskip("geonature")
+
+from shapely import wkt  # noqa: E402
+from shapely.geometry import Point  # noqa: E402
+
+from api2gn.gbif_parser import GBIFParser, _partition_key, _split_range  # noqa: E402
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        ("1900,2000", ["1900,1950", "1951,2000"]),
+        ("1,12", ["1,6", "7,12"]),
+        ("1,2", ["1", "2"]),
+        ("1,3", ["1,2", "3"]),
+        ("2000", None),
+        ("2000,2000", None),
+        ("*,1899", None),
+    ],
+)
+def test_split_range(value, expected):
+    assert _split_range(value) == expected
+
+
+def _in_range(value, bounds):
+    if value is None:
+        return False
+    low, _, high = bounds.partition(",")
+    high = high or low
+    return (low == "*" or int(low) <= value) and (high == "*" or value <= int(high))
+
+
+class FakeGBIFParser(GBIFParser):
+    """
+    Counts the records of an in-memory occurrence list: (year, month, x, y)
+    """
+
+    partition_max_records = 4
+    prefetch_pages = 1
+
+    def __init__(self, records):
+        self.records = records
+
+    def count_records(self, filters):
+        return sum(1 for record in self.records if self.matches(record, filters))
+
+    def matches(self, record, filters):
+        year, month, x, y = record
+        if "year" in filters and not _in_range(year, filters["year"]):
+            return False
+        if "month" in filters and not _in_range(month, filters["month"]):
+            return False
+        if "wkt" in filters:
+            if x is None or not wkt.loads(filters["wkt"]).intersects(Point(x, y)):
+                return False
+        return True
+
+
+def test_split_partition():
+    parser = FakeGBIFParser([])
+    years = parser.split_partition({"country": "FR"})
+    assert [sub["year"] for sub in years] == [
+        f"*,{parser.partition_min_year - 1}",
+        f"{parser.partition_min_year},{date.today().year}",
+    ]
+    assert [sub["month"] for sub in parser.split_partition({"year": "2000"})] == [
+        "1,6",
+        "7,12",
+    ]
+    tiles = parser.split_partition({"year": "2000", "month": "5"})
+    assert len(tiles) == 4 and all(sub["year"] == "2000" for sub in tiles)
+    assert parser.split_partition({"year": "2000"}, by_date=False) == [
+        {"year": "2000", "wkt": sub["wkt"]} for sub in tiles
+    ]
+
+
+def test_plan_partitions_keeps_records_without_date():
+    records = [(None, None, -100, 40)] * 3 + [(2000, 5, 10, 10)] * 3
+    parser = FakeGBIFParser(records)
+    partitions = parser.plan_partitions({})
+    assert sum(count for _filters, count in partitions) == len(records)
+    assert all(count <= parser.partition_max_records for _f, count in partitions)
+
+
+def test_resume_task():
+    parser = FakeGBIFParser([])
+    first, second = {"year": "1,2"}, {"year": "3"}
+    tasks = [(first, 0), (first, 300), (second, 0)]
+    assert parser._resume_task(tasks, {}) == 0
+    cursor = {"partition": _partition_key(first), "offset": 0}
+    assert parser._resume_task(tasks, cursor) == 1
+    cursor = {"partition": _partition_key(first), "offset": 300}
+    assert parser._resume_task(tasks, cursor) == 2
+    cursor = {"partition": _partition_key({"year": "4"}), "offset": 0}
+    assert parser._resume_task(tasks, cursor) == 0
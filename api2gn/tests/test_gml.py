@@ -0,0 +1,89 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+# api2gn.gml shares the numpy / shapely 2 detection of api2gn.mixins
+pytest.importorskip("geonature")
+
+from api2gn.gml import decode_gml, find_gml_geometry, gml_to_shape  # noqa: E402
+from api2gn.mixins import SHAPELY_2  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not SHAPELY_2, reason="needs shapely 2 and numpy")
+
+GML = 'xmlns:gml="http://www.opengis.net/gml"'
+GML_32 = 'xmlns:gml="http://www.opengis.net/gml/3.2"'
+
+
+def element(text):
+    return ET.fromstring(text)
+
+
+def test_points():
+    geoms = decode_gml(
+        [
+            element(f"<gml:Point {GML_32}><gml:pos>1 2</gml:pos></gml:Point>"),
+            None,
+            element(
+                f"<gml:Point {GML}><gml:coordinates>3,4</gml:coordinates></gml:Point>"
+            ),
+            element(
+                f'<gml:Point {GML_32} srsDimension="3"><gml:pos>5 6 7</gml:pos></gml:Point>'
+            ),
+        ]
+    )
+    assert [geom.wkt if geom else None for geom in geoms] == [
+        "POINT (1 2)",
+        None,
+        "POINT (3 4)",
+        "POINT (5 6)",
+    ]
+
+
+def test_linestring_pos_list():
+    geom = gml_to_shape(
+        element(
+            f"<gml:LineString {GML_32}><gml:posList>0 0 1 1 2 0</gml:posList>"
+            "</gml:LineString>"
+        )
+    )
+    assert geom.wkt == "LINESTRING (0 0, 1 1, 2 0)"
+
+
+def test_polygons_gml_3_and_2():
+    ring = "0 0 4 0 4 4 0 4 0 0"
+    hole = "1 1 2 1 2 2 1 2 1 1"
+    gml_3 = element(
+        f"<gml:Polygon {GML_32}>"
+        f"<gml:exterior><gml:LinearRing><gml:posList>{ring}</gml:posList>"
+        "</gml:LinearRing></gml:exterior>"
+        f"<gml:interior><gml:LinearRing><gml:posList>{hole}</gml:posList>"
+        "</gml:LinearRing></gml:interior></gml:Polygon>"
+    )
+    gml_2 = element(
+        f"<gml:Polygon {GML}><gml:outerBoundaryIs><gml:LinearRing>"
+        "<gml:coordinates>0,0 4,0 4,4 0,4 0,0</gml:coordinates>"
+        "</gml:LinearRing></gml:outerBoundaryIs></gml:Polygon>"
+    )
+    with_hole, without_hole = decode_gml([gml_3, gml_2])
+    assert with_hole.area == 15
+    assert len(with_hole.interiors) == 1
+    assert without_hole.area == 16
+
+
+def test_lat_lon_axis_order():
+    geom = gml_to_shape(
+        element(
+            f'<gml:Point {GML_32} srsName="urn:ogc:def:crs:EPSG::4326">'
+            "<gml:pos>48 2</gml:pos></gml:Point>"
+        )
+    )
+    assert (geom.x, geom.y) == (2, 48)
+
+
+def test_find_gml_geometry():
+    feature = element(
+        f"<feature {GML_32}><geom><gml:MultiSurface><gml:surfaceMember>"
+        "<gml:Polygon/></gml:surfaceMember></gml:MultiSurface></geom></feature>"
+    )
+    assert find_gml_geometry(feature).tag.endswith("Polygon")
+    assert find_gml_geometry(element("<feature/>")) is None
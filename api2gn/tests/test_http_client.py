@@ -0,0 +1,103 @@
+import pytest
+
+from api2gn import http_client
+from api2gn.http_client import (
+    CircuitBreaker,
+    HostUnavailable,
+    HTTPClient,
+    TokenBucket,
+    get_rate_limiter,
+)
+
+
+class FakeClock:
+    """
+    time.monotonic / time.sleep of http_client, sleeping moves the clock
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.slept.append(delay)
+        self.now += delay
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(http_client.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(http_client.time, "sleep", clock.sleep)
+    return clock
+
+
+def test_token_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.slept == []
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.5)]
+
+
+def test_token_bucket_pause(clock):
+    bucket = TokenBucket(rate=0)
+    bucket.pause(10)
+    bucket.pause(5)
+    bucket.acquire()
+    assert sum(clock.slept) == pytest.approx(10)
+
+
+def test_circuit_breaker(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.failure()
+    breaker.check("host")
+    breaker.failure()
+    with pytest.raises(HostUnavailable) as error:
+        breaker.check("host")
+    assert error.value.retry_after == pytest.approx(60)
+    clock.now += 45
+    with pytest.raises(HostUnavailable) as error:
+        breaker.check("host")
+    assert error.value.retry_after == pytest.approx(15)
+    clock.now += 15
+    # half-open: a single request tests the host
+    breaker.check("host")
+    with pytest.raises(HostUnavailable):
+        breaker.check("host")
+    breaker.success()
+    breaker.check("host")
+
+
+def test_circuit_breaker_disabled(clock):
+    breaker = CircuitBreaker(threshold=0)
+    for _ in range(10):
+        breaker.failure()
+    breaker.check("host")
+
+
+def test_rate_limits_per_host():
+    client = HTTPClient(rate_limits={"api.gbif.org": 5, "*": 2})
+    assert client.rate_limiter("https://api.gbif.org/v1/occurrence").rate == 5
+    assert client.rate_limiter("https://example.org/wfs").rate == 2
+    assert HTTPClient().rate_limiter("https://unlimited.example.org/") is None
+
+
+def test_throttle_pauses_the_host():
+    client = HTTPClient()
+    client.throttle("https://throttled.example.org/wfs", 30)
+    limiter = get_rate_limiter("throttled.example.org", 0)
+    assert client.rate_limiter("https://throttled.example.org/") is limiter
+    assert limiter.paused_until > 0
+    assert client.stats["throttled"] == 1
+
+
+def test_stats():
+    stats = HTTPClient().stats
+    assert stats["requests"] == 0
+    assert stats["bytes"] == 0
+    assert stats["connections"] == 0
@@ -0,0 +1,51 @@
+from datetime import date, datetime
+from uuid import UUID
+
+import pytest
+
+# the loader imports the GeoNature synthese model
+pytest.importorskip("geonature")
+
+from geoalchemy2.elements import WKBElement, WKTElement  # noqa: E402
+from shapely import wkb  # noqa: E402
+from shapely.geometry import Point  # noqa: E402
+
+from api2gn.loader import SyntheseLoader  # noqa: E402
+
+
+@pytest.fixture
+def loader():
+    # _copy_value does not use the database
+    return SyntheseLoader.__new__(SyntheseLoader)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (None, "\\N"),
+        (True, "t"),
+        (False, "f"),
+        (12, "12"),
+        (1.5, "1.5"),
+        ("a\tb\nc\rd\\e", "a\\tb\\nc\\rd\\\\e"),
+        ("\\N", "\\\\N"),
+        (date(2020, 5, 1), "2020-05-01"),
+        (datetime(2020, 5, 1, 10, 30), "2020-05-01T10:30:00"),
+        (
+            UUID("12345678-1234-5678-1234-567812345678"),
+            "12345678-1234-5678-1234-567812345678",
+        ),
+        ({"comment": "l'été\n"}, '{"comment": "l\'\\\\u00e9t\\\\u00e9\\\\n"}'),
+        (WKTElement("POINT(1 2)", srid=2154), "SRID=2154;POINT(1 2)"),
+    ],
+)
+def test_copy_value(loader, value, expected):
+    assert loader._copy_value(value) == expected
+
+
+def test_copy_value_wkb(loader):
+    point = Point(1, 2)
+    value = WKBElement(wkb.dumps(point), srid=4326)
+    assert loader._copy_value(value) == wkb.dumps(point, hex=True, srid=4326)
+    extended = WKBElement(wkb.dumps(point, hex=True, srid=4326), extended=True)
+    assert loader._copy_value(extended) == extended.desc
@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import pytest
+
+from api2gn.ogc_filter import match, parse_filters, to_cql, to_fes
+
+
+def test_parse_filters():
+    conditions = parse_filters(
+        {
+            "bbox": (0, 1, 2, 3),
+            "properties": {
+                "code": "A",
+                "codes": ["A", "B"],
+                "date_obs": {">=": "2020-01-01"},
+            },
+            "since_last_import": "date_modif",
+        },
+        "geom",
+        2154,
+        datetime(2024, 1, 1),
+    )
+    assert conditions == [
+        ("geom", "bbox", (0, 1, 2, 3, 2154)),
+        ("code", "=", "A"),
+        ("codes", "in", ["A", "B"]),
+        ("date_obs", ">=", "2020-01-01"),
+        ("date_modif", ">", datetime(2024, 1, 1)),
+    ]
+
+
+@pytest.mark.parametrize(
+    "filters,geometry_property",
+    [
+        ({"bbox": (0, 1, 2, 3)}, None),
+        ({"properties": {"code": {"~": "A"}}}, "geom"),
+        ({"properties": {"codes": []}}, "geom"),
+    ],
+)
+def test_parse_filters_errors(filters, geometry_property):
+    with pytest.raises(ValueError):
+        parse_filters(filters, geometry_property, 2154)
+
+
+def test_to_fes_2():
+    fes = to_fes([("geom", "bbox", (0, 1, 2, 3, 2154)), ("code", "=", "A&B")], "2.0.0")
+    assert fes == (
+        '<fes:Filter xmlns:fes="http://www.opengis.net/fes/2.0" '
+        'xmlns:gml="http://www.opengis.net/gml/3.2"><fes:And>'
+        "<fes:BBOX><fes:ValueReference>geom</fes:ValueReference>"
+        '<gml:Envelope srsName="EPSG:2154"><gml:lowerCorner>0 1</gml:lowerCorner>'
+        "<gml:upperCorner>2 3</gml:upperCorner></gml:Envelope></fes:BBOX>"
+        "<fes:PropertyIsEqualTo><fes:ValueReference>code</fes:ValueReference>"
+        "<fes:Literal>A&amp;B</fes:Literal></fes:PropertyIsEqualTo>"
+        "</fes:And></fes:Filter>"
+    )
+
+
+def test_to_fes_1_0():
+    fes = to_fes([("geom", "bbox", (0, 1, 2, 3, 2154))], "1.0.0")
+    assert "<fes:PropertyName>geom</fes:PropertyName>" in fes
+    assert "<gml:coordinates>0,1 2,3</gml:coordinates>" in fes
+
+
+def test_to_fes_in():
+    fes = to_fes([("code", "in", ["A", "B"])], "1.1.0")
+    assert fes.count("<fes:PropertyIsEqualTo>") == 2
+    assert "<fes:Or>" in fes
+    assert "<fes:Or>" not in to_fes([("code", "in", ["A"])], "1.1.0")
+
+
+@pytest.mark.parametrize(
+    "wfs_version,attribute",
+    [
+        ("1.0.0", 'escape="\\"'),
+        ("1.1.0", 'escapeChar="\\"'),
+        ("2.0.0", 'escapeChar="\\"'),
+    ],
+)
+def test_to_fes_like_escape(wfs_version, attribute):
+    fes = to_fes([("name", "like", "Quercus%")], wfs_version)
+    assert f'<fes:PropertyIsLike wildCard="%" singleChar="_" {attribute}>' in fes
+
+
+def test_to_cql():
+    assert to_cql(
+        [
+            ("geom", "bbox", (0, 1, 2, 3, 2154)),
+            ("code", "in", ["A", "B"]),
+            ("name", "like", "l'Quercus%"),
+            ("count", ">=", 2),
+            ("valid", "=", True),
+        ]
+    ) == (
+        "BBOX(geom, 0, 1, 2, 3, 'EPSG:2154') AND code IN ('A', 'B') "
+        "AND name LIKE 'l''Quercus%' AND count >= 2 AND valid = true"
+    )
+
+
+def test_match():
+    conditions = [
+        ("geom", "bbox", (0, 1, 2, 3, 2154)),
+        ("code", "in", ["A", "B"]),
+        ("name", "like", "Quercus%"),
+        ("count", ">=", 2),
+    ]
+    feature = {"code": "B", "name": "Quercus robur", "count": "3"}
+    assert match(conditions, feature.get)
+    assert not match(conditions, {**feature, "count": "1"}.get)
+    assert not match(conditions, {**feature, "name": "Fagus"}.get)
+    assert not match(conditions, {**feature, "count": "n/a"}.get)
+    assert not match(conditions, {"code": "B", "name": "Quercus robur"}.get)
@@ -0,0 +1,62 @@
+import xml.etree.ElementTree as ET
+
+import pytest
+
+# the parsers import the GeoNature app and models
+pytest.importorskip("geonature")
+
+from api2gn.parsers import JSONParser, WFSParser  # noqa: E402
+
+
+class RowJSONParser(JSONParser):
+    def build_object(self, row):
+        return super().build_object(row)
+
+
+class PageJSONParser(RowJSONParser):
+    def build_objects(self, page):
+        return super().build_objects(page)
+
+
+class RowWFSParser(WFSParser):
+    def build_object(self, row):
+        return super().build_object(row)
+
+
+def new(cls):
+    # the decision only depends on the class, not on the database
+    return cls.__new__(cls)
+
+
+def test_bulk_load_by_default():
+    assert new(JSONParser).use_bulk_load()
+    assert new(WFSParser).use_bulk_load()
+
+
+def test_build_object_override_uses_row_path():
+    assert not new(RowJSONParser).use_bulk_load()
+    assert not new(RowWFSParser).use_bulk_load()
+
+
+def test_build_objects_override_keeps_bulk_load():
+    assert new(PageJSONParser).use_bulk_load()
+
+
+FEATURE = """
+<wfs:member xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:ms="http://mapserver">
+  <ms:obs>
+    <ms:id>1</ms:id>
+    <!-- comment -->
+    <ms:taxon><ms:nom>Quercus robur</ms:nom><ms:id>2</ms:id></ms:taxon>
+    <ms:date/>
+  </ms:obs>
+</wfs:member>
+"""
+
+
+@pytest.mark.parametrize("name", ["obs", "id", "taxon", "nom", "date", "missing"])
+def test_find_xml_tag_as_find(name):
+    feature = ET.fromstring(FEATURE)
+    parser = new(WFSParser)
+    assert parser.find_xml_tag(feature, name) is feature.find(".//{*}" + name)
+    assert parser.get_xml_value(feature, "nom") == "Quercus robur"
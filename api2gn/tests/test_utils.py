@@ -0,0 +1,23 @@
+import pytest
+
+from api2gn.utils import geojson_srid
+
+
+@pytest.mark.parametrize(
+    "name,expected",
+    [
+        ("EPSG:2154", 2154),
+        ("urn:ogc:def:crs:EPSG::2154", 2154),
+        ("urn:ogc:def:crs:EPSG:6.9:2154", 2154),
+        ("http://www.opengis.net/def/crs/EPSG/0/3857", 3857),
+        ("urn:ogc:def:crs:OGC:1.3:CRS84", 4326),
+        ("urn:ogc:def:crs:ESRI::102110", None),
+    ],
+)
+def test_geojson_srid(name, expected):
+    document = {"type": "FeatureCollection", "crs": {"properties": {"name": name}}}
+    assert geojson_srid(document) == expected
+
+
+def test_geojson_srid_defaults_to_wgs84():
+    assert geojson_srid({"type": "FeatureCollection", "features": []}) == 4326
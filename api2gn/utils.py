@@ -1,9 +1,14 @@
 import inspect
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from importlib import import_module
+from itertools import islice
 import click
-from dateutil.parser import parse
 import re
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from api2gn.dates import parse_date_range
 
 
 def validate_date(date_string: str) -> bool:
@@ -14,44 +19,90 @@ def validate_date(date_string: str) -> bool:
     else:
         return False
     
-def generate_date_range(partial_date: str) -> list[str,str]:
+def generate_date_range(partial_date: str) -> tuple[str, str]:
     """Check date input and generate date min/max values
 
     Args:
-        partial_date (_type_): _description_
+        partial_date (str): YYYY, YYYY-MM, YYYY-MM-DD, a datetime or an
+            ISO 8601 interval (start/end), see api2gn.dates
 
     Raises:
-        ValueError: _description_
+        ValueError: if the date cannot be read
 
     Returns:
-        _type_: _description_
+        tuple[str, str]: date min and date max
     """
-    patterns = {
-        'YYYY': r'^\d{4}$',
-        'YYYY-MM': r'^\d{4}-\d{2}$',
-        'YYYY-MM-DD': r'^\d{4}-\d{2}-\d{2}$'
-    }
-
-    # Year only
-    if re.match(patterns['YYYY'], partial_date):
-        min_date = f"{partial_date}-01-01"
-        max_date = f"{partial_date}-12-31"
-    # Year and month
-    elif re.match(patterns['YYYY-MM'], partial_date):  # Format: YYYY-MM
-        min_date = f"{partial_date}-01"
-        max_date = f"{partial_date}-{(datetime.strptime(partial_date, '%Y-%m').month + 1) % 12 or 12:02d}-01"
-        max_date = (datetime.strptime(max_date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
-    # Full date
-    elif re.match(patterns['YYYY-MM-DD'], partial_date):  # Format: YYYY-MM-DD
-        min_date = partial_date
-        max_date = partial_date
-    else:
+    return parse_date_range(partial_date)
+
+
+def iter_concurrent(func, args, max_workers):
+    """Call func on each item of args in a thread pool and yield the results
+    in the order of args, with at most max_workers calls in flight
+
+    Args:
+        func (callable): function called with one item of args
+        args (iterable): items to process, consumed lazily
+        max_workers (int): number of concurrent calls
+
+    Yields:
+        the result of func for each item, in order
+    """
+    args = iter(args)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = deque(executor.submit(func, arg) for arg in islice(args, max_workers))
         try:
-            min_date = max_date = parse(partial_date).strftime('%Y-%m-%d %H:%M:%S')
-        except:
-            raise ValueError(f"Invalid date format for {partial_date}. Please use YYYY, YYYY-MM, or a valid date format.")
+            while futures:
+                future = futures.popleft()
+                for arg in islice(args, 1):
+                    futures.append(executor.submit(func, arg))
+                yield future.result()
+        finally:
+            # consumer stopped early: do not start the pending calls
+            for future in futures:
+                future.cancel()
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After HTTP header
+
+    Args:
+        value (str): delay in seconds or HTTP date, may be None
 
-    return min_date, max_date
+    Returns:
+        float: seconds to wait (None if missing or invalid)
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def geojson_srid(document):
+    """SRID of a GeoJSON document
+
+    Args:
+        document (dict): GeoJSON object, its optional "crs" member names the
+            CRS (EPSG:2154, urn:ogc:def:crs:EPSG::2154,
+            http://www.opengis.net/def/crs/EPSG/0/2154...)
+
+    Returns:
+        int: EPSG code, 4326 without "crs" (RFC 7946), None if not an EPSG code
+    """
+    crs = document.get("crs")
+    if not crs:
+        return 4326
+    name = str((crs.get("properties") or {}).get("name") or "")
+    if name.upper().endswith("CRS84"):
+        return 4326
+    match = re.search(r"EPSG(?:/[\d.]+/|:[\d.]*:|:)(\d+)$", name, re.IGNORECASE)
+    return int(match.group(1)) if match else None
 
 
 def list_parsers():
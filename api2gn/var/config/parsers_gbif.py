@@ -19,7 +19,7 @@ from api2gn.gbif_parser import GBIFParser
 class GBIFParserInaturalist(GBIFParser):
     name = "GBIF_INaturalist"
     description = "Le Parser GBIF_INaturalist permet de récupérer les données en provenance de INaturalist depuis la plateforme du GBIF. Vous pouvez mettre un JDD et une zone geographique, ou une liste d'identifiants" 
-    # url = "" # pas nécessaire car usage de la lib pygbif
+    # url = "" # pas nécessaire, l'API GBIF est appelée directement
 
     limit = 100 # Limit du parser, mettre équivalent du limit de l'API (max 300)
     # filter api search occurences
@@ -37,6 +37,12 @@ class GBIFParserInaturalist(GBIFParser):
     
     #--> La recherche par id est prioritaire sur la recherche par filtre
 
+    # Au-delà de 100 000 occurrences, découper la recherche (année, mois, zones)
+    # partitioned = True
+    # ou utiliser un téléchargement GBIF (DwC-A)
+    # download_key = "0001234-240101123456789" # clé d'un téléchargement GBIF
+    # dwca_path = "/chemin/vers/0001234-240101123456789.zip" # ou zip local
+
     ### Exemple dynamic_fields 
     # dynamic_fields = {
     #     # "unique_dataset_id" : "69f26484-08b6-4ccf-aeeb-42124d124fa1", # JDD test Inaturalist